@@ -3,18 +3,22 @@ import streamlit as st
 import logging
 import sys
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Configuração da página (DEVE SER A PRIMEIRA CHAMADA STREAMLIT)
-st.set_page_config(
-    page_title="Sistema de Gestão de Dados - V.Ferreira",
-    page_icon="📊",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+# Configuração da página (DEVE SER A PRIMEIRA CHAMADA STREAMLIT; uma vez por sessão)
+if not st.session_state.get('_page_configured'):
+    st.set_page_config(
+        page_title="Sistema de Gestão de Dados - V.Ferreira",
+        page_icon="📊",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    st.session_state['_page_configured'] = True
 
 # Adicionar diretório atual ao path
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -22,31 +26,155 @@ sys.path.insert(0, current_dir)
 
 # Importações
 from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from database import PostgresDatabaseManager
-from login import login_page
-from dashboard import manager_page
+from sessao import iniciar_cookies, restaurar_sessao_do_cookie
+from perf import traced_cache_data, mostrar_estatisticas_cache
+# login_page e manager_page são importados em main(), apenas para a rota usada
 
 # --- CONFIGURAÇÃO PARA STREAMLIT.IO COM SECRETS ---
+def _host_pooler(host):
+    """Converte o host do Neon no endpoint com pooler (sufixo '-pooler' no primeiro rótulo)."""
+    if not host.endswith('.neon.tech') or '-pooler' in host:
+        return host
+    return host.replace('.', '-pooler.', 1)
+
+@st.cache_data(show_spinner=False)
+def _build_pg_url():
+    """Monta a URL de conexão a partir de st.secrets uma única vez por processo.
+    
+    No Neon prefere o endpoint com pooler, que mantém conexões quentes do lado
+    do servidor; use `pooler = false` nas secrets para a conexão direta.
+    """
+    cfg = st.secrets["postgres"]
+    host = _host_pooler(cfg['host']) if cfg.get('pooler', True) else cfg['host']
+    logger.debug("Conectando ao Neon.tech: %s", host)
+    return f"postgresql://{cfg['user']}:{cfg['password']}@{host}:{cfg['port']}/{cfg['database']}?sslmode=require"
+
 try:
     # Usar st.secrets para configurações sensíveis
-    POSTGRES_CONFIG = {
-        'host': st.secrets["postgres"]["host"],
-        'port': st.secrets["postgres"]["port"],
-        'database': st.secrets["postgres"]["database"],
-        'user': st.secrets["postgres"]["user"],
-        'password': st.secrets["postgres"]["password"]
-    }
-    
-    logger.info(f"Conectando ao Neon.tech: {POSTGRES_CONFIG['host']}")
+    if 'pg_url' not in st.session_state:
+        st.session_state['pg_url'] = _build_pg_url()
+    POSTGRES_URL = st.session_state['pg_url']
     
 except Exception as e:
     st.error("❌ Erro ao carregar as configurações do banco de dados.")
     st.info("💡 Verifique se as secrets estão configuradas corretamente no Streamlit Cloud.")
-    logger.error(f"Erro nas configurações do banco: {e}")
+    logger.error("Erro nas configurações do banco: %s", e)
     st.stop()
 
-# Construção da URL de conexão
-POSTGRES_URL = f"postgresql://{POSTGRES_CONFIG['user']}:{POSTGRES_CONFIG['password']}@{POSTGRES_CONFIG['host']}:{POSTGRES_CONFIG['port']}/{POSTGRES_CONFIG['database']}"
+# --- GERENCIADOR DO BANCO (CACHE ENTRE RERUNS) ---
+@st.cache_resource(show_spinner=False)
+def get_db_manager(database_url):
+    """Retorna um único PostgresDatabaseManager (engine e pool) reutilizado entre reruns e sessões."""
+    return PostgresDatabaseManager(database_url)
+
+# --- STATUS DA CONEXÃO (SIDEBAR) ---
+# Estimativa do planner (pg_class.reltuples) em vez de COUNT(*), que varre a tabela inteira;
+# COUNT(*) só é usado quando a tabela nunca foi analisada (reltuples = -1).
+COUNT_EXPR = """
+    COALESCE(
+        NULLIF((SELECT reltuples::bigint FROM pg_class WHERE oid = 'public.bd'::regclass), -1),
+        (SELECT COUNT(*) FROM bd)
+    )
+"""
+STATUS_QUERY = f"SELECT version() AS v, {COUNT_EXPR} AS c"
+STATUS_SQL = text(STATUS_QUERY)
+COUNT_SQL = text(f"SELECT {COUNT_EXPR}")
+CONTADOR_INTERVALO_S = 30
+
+PROBE_TIMEOUT_S = 2
+
+# --- CONSULTAS EM SEGUNDO PLANO ---
+# Cada consulta faz o seu próprio checkout curto do pool. Não há conexão única por rerun
+# em session_state: o status roda numa thread do pool enquanto a página usa a thread do
+# script, e uma Connection do SQLAlchemy não pode ser usada por duas threads ao mesmo tempo.
+@st.cache_resource(show_spinner=False)
+def get_executor():
+    """Pool de threads do processo para consultas que rodam enquanto a página é montada."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="probe")
+
+def _com_contexto(ctx, func, *args):
+    """Executa func numa thread do pool com o contexto do rerun (st.cache_data e session_state).
+    
+    O contexto anterior da thread é restaurado ao final: a próxima tarefa não herda a sessão desta.
+    """
+    thread = threading.current_thread()
+    anterior = get_script_run_ctx(suppress_warning=True)
+    add_script_run_ctx(thread, ctx)
+    try:
+        return func(*args)
+    finally:
+        add_script_run_ctx(thread, anterior)
+
+def iniciar_status_conexao(db_manager):
+    """Dispara a consulta de status em segundo plano; None se a sessão já a fez."""
+    if st.session_state.get('db_probed'):
+        return None
+    return get_executor().submit(_com_contexto, get_script_run_ctx(), get_status_banco, db_manager)
+
+@traced_cache_data(ttl=30, show_spinner=False)
+def get_status_banco(_db_manager):
+    """Versão do PostgreSQL e total de registros da BD numa única ida ao servidor.
+    
+    No Neon usa o endpoint HTTP (uma única requisição HTTPS); o pool SQLAlchemy
+    fica como fallback e continua responsável pelo trabalho transacional.
+    """
+    if _db_manager.http_disponivel():
+        try:
+            version, record_count = _db_manager.http_query(STATUS_QUERY)[0]
+            return version, int(record_count)
+        except Exception as e:
+            logger.warning("Consulta HTTP ao Neon falhou, usando o pool: %s", e)
+    
+    with _db_manager.engine.connect() as conn:
+        row = conn.execute(STATUS_SQL).one()
+    return row.v, row.c
+
+@traced_cache_data(ttl=CONTADOR_INTERVALO_S, show_spinner=False)
+def get_contador_registros(_db_manager):
+    """Contagem de registros da BD, relida apenas no primeiro rerun após a expiração do TTL.
+    
+    Sem thread em segundo plano: com a app ociosa nenhuma consulta é feita e o
+    compute do Neon pode suspender (scale-to-zero).
+    """
+    with _db_manager.engine.connect() as conn:
+        return conn.execute(COUNT_SQL).scalar()
+
+def mostrar_status_conexao(db_manager, placeholder, futuro=None):
+    """Preenche o placeholder do sidebar com o status da conexão (consulta apenas uma vez por sessão).
+    
+    futuro é a consulta disparada por iniciar_status_conexao antes da página ser montada.
+    """
+    try:
+        if not st.session_state.get('db_probed'):
+            with placeholder, st.spinner("Verificando conexão..."):
+                if futuro is not None:
+                    version, record_count = futuro.result(timeout=PROBE_TIMEOUT_S)
+                else:
+                    version, record_count = get_status_banco(db_manager)
+            st.session_state['db_version'] = version
+            st.session_state['db_count'] = record_count
+            st.session_state['db_probed'] = True
+        
+        # Contagem relida quando o TTL expira; a da sessão serve se a releitura falhar
+        try:
+            record_count = get_contador_registros(db_manager)
+        except Exception as e:
+            logger.warning("Falha ao atualizar contagem de registros: %s", e)
+            record_count = st.session_state['db_count']
+        
+        with placeholder.container():
+            st.success(f"✅ Conectado ao Neon.tech")
+            st.info(f"📊 Registros na BD: ~{record_count:,}")
+            
+    except (OperationalError, FuturesTimeoutError) as e:
+        # Timeouts (servidor ou espera pela thread): degrada para um aviso em vez de erro
+        placeholder.warning("⚠️ DB lento")
+        logger.warning("Verificação de status excedeu o tempo limite: %s", e)
+    except Exception as e:
+        placeholder.error(f"❌ Erro na conexão: {e}")
 
 # --- FUNÇÃO PRINCIPAL ---
 def main():
@@ -57,35 +185,32 @@ def main():
         st.session_state['authenticated'] = False
         st.session_state['user'] = None
 
+    # Sessão salva em cookie assinado (novas abas / reconexões não passam pelo login)
+    iniciar_cookies()
+    if not st.session_state['authenticated']:
+        restaurar_sessao_do_cookie()
+
     # Configuração do DB
     try:
-        db_manager = PostgresDatabaseManager(POSTGRES_URL)
-        
-        # Mostrar status da conexão no sidebar
-        try:
-            with db_manager.engine.connect() as conn:
-                result = conn.execute(text("SELECT version()"))
-                version = result.scalar()
-                st.sidebar.success(f"✅ Conectado ao Neon.tech")
-                
-                # Contar registros
-                count_result = conn.execute(text("SELECT COUNT(*) FROM bd"))
-                record_count = count_result.scalar()
-                st.sidebar.info(f"📊 Registros na BD: {record_count:,}")
-                
-        except Exception as e:
-            st.sidebar.error(f"❌ Erro na conexão: {e}")
-            
+        db_manager = get_db_manager(POSTGRES_URL)
     except Exception as e:
         st.error(f"O aplicativo não pôde se conectar ao banco de dados.")
-        logger.error(f"Falha na inicialização do banco de dados: {e}")
+        logger.error("Falha na inicialização do banco de dados: %s", e)
         return
 
-    # Roteamento
+    # Roteamento (a página de login não consulta a tabela BD)
     if st.session_state['authenticated']:
+        # Reserva o topo do sidebar; a consulta de status roda enquanto a página é montada
+        status_placeholder = st.sidebar.empty()
+        futuro_status = iniciar_status_conexao(db_manager)
+        from dashboard import manager_page
         manager_page(db_manager)
+        mostrar_status_conexao(db_manager, status_placeholder, futuro_status)
+        if st.session_state['user']['role'] == 'Administrador':
+            mostrar_estatisticas_cache()
     else:
-        login_page(db_manager)
+        from login import login_page, carregar_assets_login
+        login_page(db_manager, assets=carregar_assets_login())
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -3,14 +3,142 @@ import streamlit as st
 import pandas as pd
 import bcrypt
 import logging
+import os
+import re
+import tempfile
+import threading
+import time
 import chardet
-import io
+import codecs
 import csv
-from sqlalchemy import create_engine, text
+import hashlib
+import io
+import json
+import urllib.request
+import pyarrow as pa
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+from psycopg2.extras import execute_values
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.exc import SQLAlchemyError
+from perf import traced_cache_data
 
 logger = logging.getLogger(__name__)
 
+# Leitura direta para Arrow (ConnectorX, em Rust), sem desserializar linha a linha no psycopg2, quando instalado
+try:
+    import connectorx as cx
+    CONNECTORX_AVAILABLE = True
+except ImportError:
+    CONNECTORX_AVAILABLE = False
+
+# Cache em Parquet dos relatórios detalhados (sobrevive ao reinício do processo). Contém dados de
+# clientes: fica no diretório temporário do sistema, fora da árvore do projeto
+RELATORIOS_CACHE_DIR = os.getenv(
+    "RELATORIOS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "folha_trab_cache_reports")
+)
+RELATORIOS_CACHE_TTL_S = 600
+
+# Custo do bcrypt (2^custo rodadas): 10 por padrão; use BCRYPT_COST=12 em produção se a latência do login permitir
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", "10"))
+
+# Pool do SQLAlchemy compartilhado por todas as sessões do processo (ajustável por variável de ambiente)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# O bcrypt libera o GIL durante o hash: hashes de sessões diferentes rodam em paralelo
+_HASH_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bcrypt")
+
+# Refresh das views do dashboard fora da sessão do usuário; uma thread só, para os REFRESH não se sobreporem
+_REFRESH_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refresh_views")
+
+# Prefixo de um hash bcrypt válido ($2a$, $2b$ ou $2y$ + custo com dois dígitos)
+_BCRYPT_RE = re.compile(rb"\$2[aby]\$\d\d\$")
+
+# Limite de falhas de login por (username, IP do cliente) no processo: poupa CPU do bcrypt contra tentativas
+# repetidas sem que outro cliente consiga bloquear a conta. No máximo MAX_CHAVES_FALHAS chaves (LRU).
+MAX_FALHAS_LOGIN = 5
+JANELA_FALHAS_LOGIN_S = 300
+MAX_CHAVES_FALHAS = 10000
+_FALHAS_LOGIN = OrderedDict()
+_FALHAS_LOGIN_LOCK = threading.Lock()
+
+def _latin1_fallback(erro):
+    """Handler de decodificação: bytes inválidos no encoding detectado são lidos como Latin-1."""
+    if isinstance(erro, UnicodeDecodeError):
+        return erro.object[erro.start:erro.end].decode('latin-1'), erro.end
+    raise erro
+
+codecs.register_error('latin1_fallback', _latin1_fallback)
+
+class _FluxoCsvFiltrado:
+    """Arquivo só de leitura para o COPY: relê o upload com csv.reader e o reescreve em UTF-8.
+    
+    Mesmo critério do read_csv(header=None, on_bad_lines='skip') antigo: linhas com mais campos
+    que num_colunas são descartadas (contadas em descartadas), as com menos são completadas com
+    campos vazios (NULL no COPY) e linhas em branco são ignoradas.
+    """
+    LINHAS_POR_BLOCO = 1000
+
+    def __init__(self, arquivo, encoding, separador, num_colunas, erros='strict'):
+        arquivo.seek(0)
+        self._linhas = csv.reader(self._linhas_texto(arquivo, encoding, erros), delimiter=separador)
+        self._separador = separador
+        self._num_colunas = num_colunas
+        self._buffer = bytearray()
+        self.descartadas = 0
+
+    @staticmethod
+    def _linhas_texto(arquivo, encoding, erros, tamanho_bloco=1 << 16):
+        """Linhas do upload decodificadas em blocos (TextIOWrapper fecharia o upload ao ser descartado).
+        
+        O decoder incremental guarda sequências multibyte cortadas entre blocos e as resolve
+        (ou passa ao handler de erros) no fim do arquivo.
+        """
+        decoder = codecs.getincrementaldecoder(encoding)(errors=erros)
+        resto = ''
+        for bloco in iter(lambda: arquivo.read(tamanho_bloco), b''):
+            linhas = (resto + decoder.decode(bloco)).split('\n')
+            resto = linhas.pop()
+            for linha in linhas:
+                yield linha + '\n'
+        resto += decoder.decode(b'', final=True)
+        if resto:
+            yield resto
+
+    def _proximo_bloco(self):
+        """Próximas LINHAS_POR_BLOCO linhas válidas já serializadas em UTF-8 (b'' no fim do arquivo)."""
+        saida = io.StringIO()
+        escritor = csv.writer(saida, delimiter=self._separador, lineterminator='\n')
+        escritas = 0
+        for campos in self._linhas:
+            if not campos:
+                continue
+            if len(campos) > self._num_colunas:
+                self.descartadas += 1
+                continue
+            escritor.writerow(campos + [''] * (self._num_colunas - len(campos)))
+            escritas += 1
+            if escritas == self.LINHAS_POR_BLOCO:
+                break
+        return saida.getvalue().encode('utf-8')
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            bloco = self._proximo_bloco()
+            if not bloco:
+                break
+            self._buffer += bloco
+        if size < 0:
+            size = len(self._buffer)
+        dados = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return dados
+
 class PostgresDatabaseManager:
     """Gerencia a conexão e operações com o banco de dados PostgreSQL, 
     incluindo autenticação segura (bcrypt) e operações de dados otimizadas.
@@ -37,23 +165,55 @@ class PostgresDatabaseManager:
         "est_inspec": "est_inspec" 
     }
     
+    # Colunas geradas (STORED) com o valor normalizado: filtros comparam direto, sem UPPER/LOWER(TRIM()) por linha
+    COLUNAS_NORMALIZADAS = {
+        'criterio_norm': "UPPER(TRIM(criterio))",
+        'pt_norm': "UPPER(TRIM(pt))",
+        'localidade_norm': "UPPER(TRIM(localidade))",
+        'estado_norm': "LOWER(TRIM(estado))",
+        'anomalia_norm': "UPPER(TRIM(anomalia))",
+        'est_contr_norm': "UPPER(TRIM(est_contr))",
+        'sit_div_norm': "UPPER(TRIM(sit_div))",
+        'est_inspec_norm': "UPPER(TRIM(est_inspec))",
+        'desv_norm': "UPPER(TRIM(desv))",
+        'desc_tp_cli_norm': "UPPER(TRIM(desc_tp_cli))"
+    }
+    
+    # Consultas quentes pré-construídas: o mesmo TextClause mantém o cache de compilação do SQLAlchemy
+    SQL_BUSCAR_USUARIO = text("SELECT id, username, password_hash, nome, role FROM usuarios WHERE username = :username")
+    SQL_INSERIR_USUARIO = text("INSERT INTO usuarios (username, password_hash, nome, role) VALUES (:username, :password_hash, :nome, :role)")
+    SQL_EDITAR_USUARIO = text("UPDATE usuarios SET nome = :nome, role = :role WHERE id = :id")
+    SQL_ALTERAR_SENHA = text("UPDATE usuarios SET password_hash = :hash WHERE id = :id")
+    
+    # Limites por sessão para consultas interativas; cargas em massa usam _sem_limite_de_tempo
+    TIMEOUTS_SESSAO = {
+        'statement_timeout': 3000,
+        'idle_in_transaction_session_timeout': 5000,
+        'lock_timeout': 1000
+    }
+    
     def __init__(self, database_url):
         self.database_url = database_url
         self.engine = None
+        # Definições das views por instância: _ativar_hll troca a de 'stats' sem tocar na da classe
+        self.VIEWS_DASHBOARD = dict(type(self).VIEWS_DASHBOARD)
         
         try:
-            # Configurações otimizadas para desenvolvimento local
+            # Pool dimensionado para várias sessões simultâneas; LIFO reutiliza as conexões
+            # mais recentes (quentes). Conexões derrubadas pelo servidor (ex.: compute do Neon
+            # suspenso) são detectadas pelo pre_ping, então o recycle pode ser longo.
             self.engine = create_engine(
                 database_url,
                 pool_pre_ping=True,
-                pool_recycle=3600,
-                pool_size=5,
-                max_overflow=10,
-                connect_args={
-                    'connect_timeout': 10,
-                    'application_name': 'vf_perdas_app_local'
-                }
+                pool_recycle=DB_POOL_RECYCLE,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+                pool_use_lifo=True,
+                connect_args=self._connect_args()
             )
+            if self._usa_pooler:
+                event.listen(self.engine, 'begin', self._timeouts_na_transacao)
             
             # Testar conexão
             with self.engine.connect() as conn:
@@ -61,6 +221,11 @@ class PostgresDatabaseManager:
                 logger.info("✅ Conexão com PostgreSQL local estabelecida com sucesso")
                 
             self.init_db()
+            # Índices e view prontos antes da primeira consulta do dashboard (IF NOT EXISTS: barato se já existem)
+            if self.criar_indices_performance():
+                # Caches do dashboard aquecidos só com índices e views prontos, na fila dos REFRESH
+                # (uma thread só): o aquecimento nunca concorre com a manutenção das views
+                _REFRESH_POOL.submit(self._prefetch_all)
             
         except Exception as e:
             error_msg = f"❌ Erro ao conectar com PostgreSQL local: {str(e)}"
@@ -92,14 +257,145 @@ class PostgresDatabaseManager:
                 
             raise
 
+    def _connect_args(self):
+        """Parâmetros do driver; o pooler do Neon (PgBouncer) rejeita o parâmetro de startup 'options'."""
+        connect_args = {
+            'connect_timeout': 10,
+            'application_name': 'vf_perdas_app_local',
+            'sslmode': 'require',
+            # Keepalives TCP: evita que o Neon feche conexões ociosas do pool silenciosamente
+            'keepalives': 1,
+            'keepalives_idle': 30,
+            'keepalives_interval': 10,
+            'keepalives_count': 3
+        }
+        if self._usa_pooler:
+            logger.info("Endpoint com pooler: timeouts aplicados por transação (SET LOCAL), não no startup")
+        else:
+            connect_args['options'] = ' '.join(f"-c {nome}={valor}" for nome, valor in self.TIMEOUTS_SESSAO.items())
+        return connect_args
+
+    @property
+    def _usa_pooler(self):
+        """Host do pooler do Neon (PgBouncer em modo transação)."""
+        return '-pooler' in (make_url(self.database_url).host or '')
+
+    def _timeouts_na_transacao(self, conn):
+        """No pooler, aplica TIMEOUTS_SESSAO com SET LOCAL no início de cada transação.
+        
+        SET de sessão vazaria para outros clientes do PgBouncer; SET LOCAL acaba no COMMIT/ROLLBACK.
+        Conexões AUTOCOMMIT (_conectar_leitura) não têm transação e ficam sem os timeouts.
+        """
+        if conn.get_execution_options().get('isolation_level') == 'AUTOCOMMIT':
+            return
+        # Direto no cursor DBAPI: o psycopg2 abre a transação implícita e o SET LOCAL vale nela
+        with conn.connection.dbapi_connection.cursor() as cur:
+            cur.execute("; ".join(f"SET LOCAL {nome} = {valor}" for nome, valor in self.TIMEOUTS_SESSAO.items()))
+
     def _get_conn(self):
         """Retorna uma conexão ativa com o banco."""
         return self.engine.connect()
 
+    def _conectar_leitura(self):
+        """Conexão do pool em AUTOCOMMIT para consultas só de leitura (sem o BEGIN/COMMIT implícito)."""
+        return self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+
+    def _sem_limite_de_tempo(self, conn):
+        """Remove os timeouts de sessão apenas na transação atual (importação e atualizações em massa)."""
+        conn.execute(text("; ".join(f"SET LOCAL {nome} = 0" for nome in self.TIMEOUTS_SESSAO)))
+
+    def _ler_em_blocos(self, conn, query, params=None, tamanho_bloco=5000):
+        """Lê o resultado por um cursor nomeado (server-side) do psycopg2, tamanho_bloco linhas por vez.
+        
+        O cliente nunca recebe o resultado inteiro de uma vez (fetchall); precisa de uma
+        transação aberta em conn, como nas operações que chamam _sem_limite_de_tempo.
+        """
+        compilado = text(query).compile(dialect=conn.dialect)
+        valores = {**compilado.params, **(params or {})}
+        blocos = []
+        with conn.connection.dbapi_connection.cursor(name='folhas_cur') as cur:
+            cur.itersize = tamanho_bloco
+            cur.execute(str(compilado), valores)
+            for bloco in iter(lambda: cur.fetchmany(tamanho_bloco), []):
+                blocos.append(pd.DataFrame.from_records(bloco, columns=[c.name for c in cur.description]))
+            colunas = [c.name for c in cur.description] if cur.description else []
+        if not blocos:
+            return pd.DataFrame(columns=colunas)
+        return pd.concat(blocos, ignore_index=True)
+
+    def _ler_arrow_em_blocos(self, conn, query, params=None, tamanho_bloco=50_000):
+        """Lê o resultado por um cursor nomeado, convertendo cada bloco de linhas em colunas Arrow.
+        
+        Só o bloco atual existe como tuplas Python; o resultado final é uma única tabela Arrow
+        (pd.ArrowDtype), sem colunas object intermediárias. Como em _ler_em_blocos, precisa de uma
+        transação aberta em conn (não AUTOCOMMIT): no pooler em modo transação o cursor só existe nela.
+        """
+        compilado = text(query).compile(dialect=conn.dialect)
+        valores = {**compilado.params, **(params or {})}
+        blocos = []
+        with conn.connection.dbapi_connection.cursor(name='relatorio_cur') as cur:
+            cur.itersize = tamanho_bloco
+            cur.execute(str(compilado), valores)
+            colunas = [c.name for c in cur.description]
+            for bloco in iter(lambda: cur.fetchmany(tamanho_bloco), []):
+                blocos.append(pa.Table.from_arrays([pa.array(coluna) for coluna in zip(*bloco)], names=colunas))
+        if not blocos:
+            return pd.DataFrame(columns=colunas)
+        # Colunas só com NULL num bloco chegam como tipo null e são promovidas ao tipo dos outros blocos
+        tabela = pa.concat_tables(blocos, promote_options='default')
+        return tabela.to_pandas(types_mapper=pd.ArrowDtype)
+
+    @property
+    def _cx_url(self):
+        """URL no formato do ConnectorX (postgresql://, sem o driver do SQLAlchemy)."""
+        return make_url(self.database_url).set(drivername='postgresql').render_as_string(hide_password=False)
+
+    def _ler_arrow(self, conn, query, params=None):
+        """Lê o resultado com o ConnectorX direto para colunas Arrow (pd.ArrowDtype).
+        
+        O ConnectorX não aceita parâmetros: os valores são escapados pelo mogrify do psycopg2.
+        Usa uma conexão própria, fora da transação de conn.
+        """
+        compilado = text(query).compile(dialect=conn.dialect)
+        valores = {**compilado.params, **(params or {})}
+        with conn.connection.dbapi_connection.cursor() as cur:
+            sql = cur.mogrify(str(compilado), valores).decode('utf-8')
+        tabela = cx.read_sql(self._cx_url, sql, return_type='arrow')
+        return tabela.to_pandas(types_mapper=pd.ArrowDtype)
+
+    # --- Consultas Pontuais via HTTP (Neon serverless) ---
+    def http_disponivel(self):
+        """Indica se o host é um endpoint Neon com suporte a SQL-over-HTTP."""
+        host = make_url(self.database_url).host or ''
+        return host.endswith('.neon.tech')
+
+    def http_query(self, sql, params=None, timeout=10):
+        """Executa uma consulta pontual pelo endpoint SQL-over-HTTP do Neon.
+
+        Evita o handshake TCP+TLS+SCRAM do pool para leituras isoladas; retorna
+        a lista de linhas (cada linha é uma lista de valores).
+        """
+        url = make_url(self.database_url)
+        requisicao = urllib.request.Request(
+            f"https://{url.host}/sql",
+            data=json.dumps({'query': sql, 'params': params or []}).encode('utf-8'),
+            headers={
+                'Content-Type': 'application/json',
+                'Neon-Connection-String': url.render_as_string(hide_password=False),
+                'Neon-Array-Mode': 'true'
+            },
+            method='POST'
+        )
+        with urllib.request.urlopen(requisicao, timeout=timeout) as resposta:
+            return json.loads(resposta.read().decode('utf-8'))['rows']
+
     # --- Inicialização e Estrutura do BD ---
     def init_db(self):
         """Cria as tabelas 'bd' e 'usuarios' e insere usuários padrão se necessário."""
         with self.engine.connect() as conn:
+            # Adicionar as colunas geradas reescreve a tabela (só na primeira vez)
+            self._sem_limite_de_tempo(conn)
+            
             # Tabela BD
             conn.execute(text('''
                 CREATE TABLE IF NOT EXISTS bd (
@@ -112,6 +408,32 @@ class PostgresDatabaseManager:
                     estado TEXT
                 )
             '''))
+            # ALTER TABLE pede ACCESS EXCLUSIVE mesmo quando nada muda: só roda para colunas ausentes
+            existentes = set(conn.execute(text(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = 'bd'"
+            )).scalars())
+            # Um único ALTER TABLE: a tabela é reescrita uma vez para todas as colunas novas
+            normalizadas = [
+                f"ADD COLUMN {coluna} TEXT GENERATED ALWAYS AS ({expressao}) STORED"
+                for coluna, expressao in self.COLUNAS_NORMALIZADAS.items() if coluna not in existentes
+            ]
+            if normalizadas:
+                conn.execute(text("ALTER TABLE bd " + ", ".join(normalizadas)))
+            
+            # Dimensões com chave inteira (<coluna>_id) para os agrupamentos por PT e localidade
+            for coluna, dimensao in self.DIMENSOES.items():
+                conn.execute(text(f"""
+                    CREATE TABLE IF NOT EXISTS {dimensao} (
+                        {coluna}_id SERIAL PRIMARY KEY,
+                        {coluna}_norm TEXT UNIQUE NOT NULL
+                    )
+                """))
+            chaves = [f"ADD COLUMN {coluna}_id INTEGER" for coluna in self.DIMENSOES if f"{coluna}_id" not in existentes]
+            if chaves:
+                conn.execute(text("ALTER TABLE bd " + ", ".join(chaves)))
+                # Chaves recém-criadas: preenche as linhas já existentes
+                self._preencher_chaves_dimensoes(conn)
             
             # Tabela de usuários
             conn.execute(text('''
@@ -129,58 +451,171 @@ class PostgresDatabaseManager:
             result = conn.execute(text("SELECT COUNT(*) FROM usuarios"))
             count = result.scalar()
             if count == 0:
+                hash_admin, hash_assadm = _HASH_POOL.map(self.hash_password, ['admin123', 'adm123'])
                 usuarios_padrao = [
-                    ('Admin', self.hash_password('admin123'), 'Administrador Principal', 'Administrador'),
-                    ('AssAdm', self.hash_password('adm123'), 'Assistente Administrativo', 'Assistente Administrativo')
+                    ('Admin', hash_admin, 'Administrador Principal', 'Administrador'),
+                    ('AssAdm', hash_assadm, 'Assistente Administrativo', 'Assistente Administrativo')
                 ]
-                for user in usuarios_padrao:
-                    conn.execute(
-                        text("INSERT INTO usuarios (username, password_hash, nome, role) VALUES (:username, :password_hash, :nome, :role)"),
-                        {"username": user[0], "password_hash": user[1], "nome": user[2], "role": user[3]}
-                    )
+                self._inserir_em_lote(conn, 'usuarios', ['username', 'password_hash', 'nome', 'role'], usuarios_padrao)
                 logger.info("Usuários padrão inseridos na inicialização")
             conn.commit()
 
+    # Colunas agrupadas por chave inteira: {coluna: tabela de dimensão com <coluna>_id e <coluna>_norm}
+    DIMENSOES = {'pt': 'dim_pt', 'localidade': 'dim_localidade'}
+
+    def _registrar_valores_dimensoes(self, conn, tabela, expressoes):
+        """Insere nas dimensões os valores ainda não registrados; expressoes = {coluna: valor normalizado em tabela}."""
+        for coluna, dimensao in self.DIMENSOES.items():
+            conn.execute(text(f"""
+                INSERT INTO {dimensao} ({coluna}_norm)
+                SELECT DISTINCT {expressoes[coluna]} FROM {tabela} WHERE {expressoes[coluna]} <> ''
+                ON CONFLICT DO NOTHING
+            """))
+
+    def _preencher_chaves_dimensoes(self, conn):
+        """Preenche pt_id/localidade_id das linhas já existentes em bd (uma vez, quando as colunas são criadas).
+        
+        A importação não passa por aqui: as chaves entram no próprio INSERT ... SELECT.
+        """
+        self._registrar_valores_dimensoes(conn, 'bd', {coluna: f"{coluna}_norm" for coluna in self.DIMENSOES})
+        # Uma passada só: cada chave vem do índice único da dimensão (NULL para valor vazio)
+        conn.execute(text("UPDATE bd t SET " + ", ".join(
+            f"{coluna}_id = (SELECT d.{coluna}_id FROM {dimensao} d WHERE d.{coluna}_norm = t.{coluna}_norm)"
+            for coluna, dimensao in self.DIMENSOES.items()
+        )))
+
+    # A partir deste número de linhas, _inserir_em_lote usa COPY em vez de INSERT ... VALUES
+    COPY_MIN_LINHAS = 10
+
+    def _inserir_em_lote(self, conn, tabela, colunas, linhas):
+        """Insere várias linhas numa única ida ao banco: COPY para lotes grandes, execute_values para os pequenos."""
+        lista_colunas = ", ".join(colunas)
+        with conn.connection.dbapi_connection.cursor() as cur:
+            if len(linhas) >= self.COPY_MIN_LINHAS:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(linhas)
+                buffer.seek(0)
+                cur.copy_expert(f"COPY {tabela} ({lista_colunas}) FROM STDIN WITH (FORMAT CSV)", buffer)
+            else:
+                # Todas as linhas num único INSERT ... VALUES (...), (...)
+                execute_values(cur, f"INSERT INTO {tabela} ({lista_colunas}) VALUES %s", linhas, page_size=100)
+
     # --- Funções de Hashing e Autenticação (bcrypt) ---
     @staticmethod
     def hash_password(password):
         """Gera um hash seguro da senha usando bcrypt."""
         if not password or len(password.strip()) == 0:
             raise ValueError("Senha não pode ser vazia")
-        # O salt é gerado automaticamente pelo bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        # O salt é gerado automaticamente pelo bcrypt.gensalt(), com o custo BCRYPT_COST
+        hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_COST))
         return hashed.decode('utf-8')
 
+    @traced_cache_data(ttl=60, show_spinner=False)
+    def _buscar_usuario(_self, username):
+        """Busca o registro do usuário para autenticação, com cache curto por username."""
+        with _self._conectar_leitura() as conn:
+            result = conn.execute(_self.SQL_BUSCAR_USUARIO, {"username": username})
+            usuario = result.fetchone()
+        return tuple(usuario) if usuario else None
+
+    def _limpar_cache_usuarios(self):
+        """Invalida os caches de usuários após qualquer alteração na tabela."""
+        PostgresDatabaseManager._buscar_usuario.clear()
+        PostgresDatabaseManager.obter_usuarios.clear()
+        PostgresDatabaseManager.contar_usuarios.clear()
+
+    def _chave_falhas(self, username):
+        """Chave do contador de falhas: username e IP do cliente (só username fora de uma sessão ou sem IP)."""
+        try:
+            ip = getattr(st.context, 'ip_address', None)
+        except Exception:
+            ip = None
+        return (username, ip)
+
+    def _falhas_recentes(self, chave):
+        """Número de falhas de chave dentro de JANELA_FALHAS_LOGIN_S; chaves sem falhas recentes são removidas."""
+        falhas = _FALHAS_LOGIN.get(chave)
+        if falhas is None:
+            return 0
+        limite = time.monotonic() - JANELA_FALHAS_LOGIN_S
+        while falhas and falhas[0] < limite:
+            falhas.popleft()
+        if not falhas:
+            del _FALHAS_LOGIN[chave]
+        return len(falhas)
+
+    def _registrar_falha_login(self, chave):
+        """Conta uma tentativa de login malsucedida para chave, descartando a chave menos recente se cheio."""
+        with _FALHAS_LOGIN_LOCK:
+            self._falhas_recentes(chave)
+            falhas = _FALHAS_LOGIN.get(chave)
+            if falhas is None:
+                falhas = _FALHAS_LOGIN[chave] = deque(maxlen=MAX_FALHAS_LOGIN)
+                if len(_FALHAS_LOGIN) > MAX_CHAVES_FALHAS:
+                    _FALHAS_LOGIN.popitem(last=False)
+            else:
+                _FALHAS_LOGIN.move_to_end(chave)
+            falhas.append(time.monotonic())
+
     def autenticar_usuario(self, username, password):
         """Verifica as credenciais do usuário usando bcrypt."""
         if not username or not password:
             return None
+        
+        username = username.strip()
+        chave_falhas = self._chave_falhas(username)
+        with _FALHAS_LOGIN_LOCK:
+            bloqueado = self._falhas_recentes(chave_falhas) >= MAX_FALHAS_LOGIN
+        if bloqueado:
+            # Não chega ao bcrypt até a janela expirar
+            logger.warning("Login temporariamente bloqueado por excesso de falhas: %s", username)
+            return None
             
-        with self.engine.connect() as conn:
-            result = conn.execute(
-                text("SELECT id, username, password_hash, nome, role FROM usuarios WHERE username = :username"),
-                {"username": username.strip()}
-            )
-            usuario = result.fetchone()
+        usuario = self._buscar_usuario(username)
         
         if usuario:
+            password_hash = usuario[2].encode('utf-8')
+            if not _BCRYPT_RE.match(password_hash):
+                # Hash malformado: rejeita sem pagar o key setup do bcrypt
+                logger.warning("Hash inválido para %s", username)
+                self._registrar_falha_login(chave_falhas)
+                return None
             try:
-                if bcrypt.checkpw(password.encode('utf-8'), usuario[2].encode('utf-8')):
-                    logger.info(f"Autenticação bem-sucedida para: {username}")
+                if bcrypt.checkpw(password.encode('utf-8'), password_hash):
+                    with _FALHAS_LOGIN_LOCK:
+                        _FALHAS_LOGIN.pop(chave_falhas, None)
+                    logger.info("Autenticação bem-sucedida para: %s", username)
                     return {'id': usuario[0], 'username': usuario[1], 'nome': usuario[3], 'role': usuario[4]}
-            except (ValueError, Exception) as e:
-                logger.warning(f"Hash inválido ou erro na autenticação para {username}: {e}")
+            except Exception as e:
+                logger.warning("Hash inválido ou erro na autenticação para %s: %s", username, e)
+                self._registrar_falha_login(chave_falhas)
                 return None 
-        logger.warning(f"Tentativa de autenticação falhou para: {username}")
+        self._registrar_falha_login(chave_falhas)
+        logger.warning("Tentativa de autenticação falhou para: %s", username)
         return None
 
     # --- Funções de Gerenciamento de Usuários ---
-    def obter_usuarios(self):
-        """Retorna a lista de todos os usuários."""
-        with self.engine.connect() as conn:
-            df = pd.read_sql_query(text("SELECT id, username, nome, role, data_criacao FROM usuarios ORDER BY username"), conn)
+    @traced_cache_data(ttl=60, show_spinner=False)
+    def obter_usuarios(_self, limit=None, offset=0):
+        """Retorna a lista de usuários (em cache; invalidada por _limpar_cache_usuarios).
+        
+        Com limit, devolve só a página [offset, offset + limit) ordenada por username.
+        """
+        query = "SELECT id, username, nome, role, data_criacao FROM usuarios ORDER BY username"
+        params = {}
+        if limit is not None:
+            query += " LIMIT :limit OFFSET :offset"
+            params = {'limit': int(limit), 'offset': int(offset)}
+        with _self._conectar_leitura() as conn:
+            df = pd.read_sql_query(text(query), conn, params=params)
         return df.to_records(index=False).tolist()
 
+    @traced_cache_data(ttl=60, show_spinner=False)
+    def contar_usuarios(_self):
+        """Retorna o total de usuários cadastrados (em cache, como obter_usuarios)."""
+        with _self._conectar_leitura() as conn:
+            return conn.execute(text("SELECT COUNT(*) FROM usuarios")).scalar()
+
     def validar_dados_usuario(self, username, password, nome, role):
         """Valida dados do usuário antes de criar/editar."""
         errors = []
@@ -201,20 +636,21 @@ class PostgresDatabaseManager:
             return False, " | ".join(validation_errors)
             
         try:
-            password_hash = self.hash_password(password)
+            password_hash = _HASH_POOL.submit(self.hash_password, password).result()
             with self.engine.connect() as conn:
                 conn.execute(
-                    text("INSERT INTO usuarios (username, password_hash, nome, role) VALUES (:username, :password_hash, :nome, :role)"),
+                    self.SQL_INSERIR_USUARIO,
                     {"username": username.strip(), "password_hash": password_hash, "nome": nome.strip(), "role": role}
                 )
                 conn.commit()
-            logger.info(f"Usuário {username} criado com sucesso")
+            self._limpar_cache_usuarios()
+            logger.info("Usuário %s criado com sucesso", username)
             return True, "Usuário criado com sucesso!"
         except SQLAlchemyError as e:
             if 'duplicate key value violates unique constraint' in str(e):
-                logger.warning(f"Tentativa de criar usuário duplicado: {username}")
+                logger.warning("Tentativa de criar usuário duplicado: %s", username)
                 return False, f"O nome de usuário '{username}' já existe."
-            logger.error(f"Erro ao criar usuário {username}: {e}")
+            logger.error("Erro ao criar usuário %s: %s", username, e)
             return False, f"Erro ao criar usuário: {e}"
 
     def editar_usuario(self, user_id, nome, role):
@@ -226,19 +662,62 @@ class PostgresDatabaseManager:
         try:
             with self.engine.connect() as conn:
                 result = conn.execute(
-                    text("UPDATE usuarios SET nome = :nome, role = :role WHERE id = :id"),
+                    self.SQL_EDITAR_USUARIO,
                     {"nome": nome.strip(), "role": role, "id": user_id}
                 )
                 conn.commit()
+            self._limpar_cache_usuarios()
             if result.rowcount > 0:
-                logger.info(f"Usuário ID {user_id} editado com sucesso")
+                logger.info("Usuário ID %s editado com sucesso", user_id)
                 return True, "Usuário editado com sucesso!"
             else:
                 return False, "Usuário não encontrado."
         except SQLAlchemyError as e:
-            logger.error(f"Erro ao editar usuário ID {user_id}: {e}")
+            logger.error("Erro ao editar usuário ID %s: %s", user_id, e)
             return False, f"Erro ao editar usuário: {e}"
 
+    def editar_usuarios_em_lote(self, alteracoes):
+        """Edita nome e função de vários usuários num único UPDATE.
+        
+        alteracoes é um dict {id: {'nome': ..., 'role': ...}}; nada é gravado se algum item for inválido.
+        """
+        if not alteracoes:
+            return True, "Nenhuma alteração para salvar."
+        
+        erros = []
+        for user_id, dados in alteracoes.items():
+            validation_errors = self.validar_dados_usuario("temp", None, dados['nome'], dados['role'])
+            validation_errors = [e for e in validation_errors if "usuário" not in e and "senha" not in e]
+            if validation_errors:
+                erros.append(f"ID {user_id}: " + " | ".join(validation_errors))
+        if erros:
+            return False, " | ".join(erros)
+        
+        ids = [int(user_id) for user_id in alteracoes]
+        try:
+            with self.engine.connect() as conn:
+                # Arrays paralelos desaninhados numa tabela (id, nome, role): uma ida ao banco para N linhas
+                result = conn.execute(
+                    text("""
+                        UPDATE usuarios AS u SET nome = d.nome, role = d.role
+                        FROM unnest(CAST(:ids AS integer[]), CAST(:nomes AS text[]), CAST(:roles AS text[]))
+                            AS d(id, nome, role)
+                        WHERE u.id = d.id
+                    """),
+                    {
+                        "ids": ids,
+                        "nomes": [alteracoes[i]['nome'].strip() for i in alteracoes],
+                        "roles": [alteracoes[i]['role'] for i in alteracoes]
+                    }
+                )
+                conn.commit()
+            self._limpar_cache_usuarios()
+            logger.info("Usuários editados em lote: %s", ids)
+            return True, f"{result.rowcount} usuário(s) editado(s) com sucesso!"
+        except SQLAlchemyError as e:
+            logger.error("Erro ao editar usuários em lote %s: %s", ids, e)
+            return False, f"Erro ao editar usuários: {e}"
+
     def excluir_usuario(self, user_id):
         """Exclui um usuário pelo ID com validações de segurança."""
         try:
@@ -258,14 +737,15 @@ class PostgresDatabaseManager:
                     {"id": user_id}
                 )
                 conn.commit()
+            self._limpar_cache_usuarios()
                 
             if result.rowcount > 0:
-                logger.info(f"Usuário ID {user_id} excluído com sucesso")
+                logger.info("Usuário ID %s excluído com sucesso", user_id)
                 return True, "Usuário excluído com sucesso!"
             else:
                 return False, "Usuário não encontrado."
         except SQLAlchemyError as e:
-            logger.error(f"Erro ao excluir usuário ID {user_id}: {e}")
+            logger.error("Erro ao excluir usuário ID %s: %s", user_id, e)
             return False, f"Erro ao excluir usuário: {e}"
 
     def alterar_senha(self, user_id, new_password):
@@ -274,191 +754,585 @@ class PostgresDatabaseManager:
             return False, "Senha deve ter pelo menos 6 caracteres"
             
         try:
-            password_hash = self.hash_password(new_password)
+            password_hash = _HASH_POOL.submit(self.hash_password, new_password).result()
             with self.engine.connect() as conn:
                 result = conn.execute(
-                    text("UPDATE usuarios SET password_hash = :hash WHERE id = :id"),
+                    self.SQL_ALTERAR_SENHA,
                     {"hash": password_hash, "id": user_id}
                 )
                 conn.commit()
+            self._limpar_cache_usuarios()
             if result.rowcount > 0:
-                logger.info(f"Senha do usuário ID {user_id} alterada com sucesso")
+                logger.info("Senha do usuário ID %s alterada com sucesso", user_id)
                 return True, "Senha alterada com sucesso!"
             else:
                 return False, "Usuário não encontrado."
         except SQLAlchemyError as e:
-            logger.error(f"Erro ao alterar senha do usuário ID {user_id}: {e}")
+            logger.error("Erro ao alterar senha do usuário ID %s: %s", user_id, e)
             return False, f"Erro ao alterar senha: {e}"
 
     # --- Funções Auxiliares de CSV ---
-    def _detectar_encoding(self, arquivo_csv):
-        """Detecta o encoding do arquivo."""
-        raw_data = arquivo_csv.getvalue()
-        result = chardet.detect(raw_data)
-        encoding = result['encoding'] or 'utf-8'
-        logger.info(f"Encoding detectado: {encoding} (confiança: {result['confidence']})")
-        return encoding
+    # Bytes do início do upload usados para detectar encoding, separador e número de colunas
+    AMOSTRA_CSV_BYTES = 64 * 1024
 
-    def _detectar_separador(self, arquivo_csv, encoding):
-        """Detecta o separador mais provável (',' ou ';')."""
+    def _amostra_csv(self, arquivo_csv):
+        """Lê apenas o início do upload (AMOSTRA_CSV_BYTES), uma vez, e volta ao começo do arquivo."""
         arquivo_csv.seek(0)
         try:
-            amostra = arquivo_csv.read(1024 * 50).decode(encoding, errors='ignore')
-            
-            virgula_count = amostra.count(',')
-            ponto_virgula_count = amostra.count(';')
-            
-            if ponto_virgula_count > virgula_count * 2:
-                separador = ';'
-            else:
-                separador = ','
-                
-            logger.info(f"Separador detectado: '{separador}' (;: {ponto_virgula_count}, ,: {virgula_count})")
-            return separador
+            return arquivo_csv.read(self.AMOSTRA_CSV_BYTES)
         finally:
             arquivo_csv.seek(0)
+
+    # Abaixo desta confiança do chardet o arquivo é tratado como UTF-8 (com fallback Latin-1)
+    CONFIANCA_MIN_ENCODING = 0.5
+
+    def _detectar_encoding(self, amostra):
+        """Detecta o encoding do arquivo a partir da amostra inicial.
+        
+        A amostra cobre só o início do arquivo: 'ascii' (nenhum byte acima de 0x7F ainda) e palpites
+        de baixa confiança viram UTF-8; bytes Latin-1 mais adiante são tratados no reenvio filtrado.
+        """
+        result = chardet.detect(amostra)
+        encoding = result['encoding'] or 'utf-8'
+        if encoding.lower() == 'ascii' or (result['confidence'] or 0) < self.CONFIANCA_MIN_ENCODING:
+            encoding = 'utf-8'
+        logger.info("Encoding detectado: %s (chardet: %s, confiança: %s)", encoding, result['encoding'], result['confidence'])
+        return encoding
+
+    def _detectar_separador(self, amostra, encoding):
+        """Detecta o separador com csv.Sniffer (',', ';', '|' ou tab); contagem de ',' e ';' como fallback."""
+        texto = amostra.decode(encoding, errors='ignore')
+        # Descarta a última linha, possivelmente cortada no limite da amostra
+        texto_completo = texto.rsplit('\n', 1)[0] if '\n' in texto else texto
+        try:
+            separador = csv.Sniffer().sniff(texto_completo, delimiters=',;|\t').delimiter
+            logger.info("Separador detectado: %r (csv.Sniffer)", separador)
+            return separador
+        except csv.Error as e:
+            logger.info("csv.Sniffer não identificou o separador (%s); usando contagem de ',' e ';'", e)
+        
+        virgula_count = texto.count(',')
+        ponto_virgula_count = texto.count(';')
+        
+        if ponto_virgula_count > virgula_count * 2:
+            separador = ';'
+        else:
+            separador = ','
+            
+        logger.info("Separador detectado: '%s' (;: %s, ,: %s)", separador, ponto_virgula_count, virgula_count)
+        return separador
     
     # --- Funções de Importação e Dados (Otimizadas) ---
     def criar_indices_performance(self):
-        """Cria índices funcionais para otimizar as queries do dashboard."""
+        """Cria índices funcionais para otimizar as queries do dashboard; False se a criação falhou."""
         try:
             with self.engine.connect() as conn:
-                # Lista de índices a serem criados
-                indices = [
-                    ("idx_bd_criterio_norm", "UPPER(TRIM(criterio))"),
-                    ("idx_bd_pt_norm", "UPPER(TRIM(pt))"),
-                    ("idx_bd_localidade_norm", "UPPER(TRIM(localidade))"),
-                    ("idx_bd_estado_norm", "LOWER(TRIM(estado))"),
-                    ("idx_bd_nib_clean", "TRIM(nib)")
-                ]
-                
-                for nome_idx, expressao in indices:
-                    try:
-                        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {nome_idx} ON bd ({expressao})"))
-                    except Exception as e:
-                        logger.warning(f"Não foi possível criar índice {nome_idx}: {e}")
-                
+                self._sem_limite_de_tempo(conn)
+                self._criar_indices(conn)
                 conn.commit()
                 logger.info("✅ Índices de performance verificados/criados com sucesso.")
+            return True
+        except Exception as e:
+            logger.error("Erro ao criar índices: %s", e)
+            return False
+
+    INDICES_OBSOLETOS = (
+        "idx_bd_criterio_norm", "idx_bd_pt_norm", "idx_bd_localidade_norm", "idx_bd_estado_norm",
+        "idx_bd_nib_active", "idx_bd_active_pt", "idx_bd_active_localidade",
+        "idx_bd_pt_norm_cov", "idx_bd_loc_norm_cov"
+    )
+
+    def _expressao_normalizada(self, coluna):
+        """Coluna gerada <coluna>_norm quando existe; senão a normalização UPPER(TRIM()) na consulta."""
+        if f"{coluna}_norm" in self.COLUNAS_NORMALIZADAS:
+            return f"{coluna}_norm"
+        return f"UPPER(TRIM({coluna}))"
+
+    def _criar_indices(self, conn):
+        """Cria os índices de bd e a view bd_distinct_values na transação de conn.
+        
+        Cada item roda num savepoint: uma falha é registrada sem abortar a transação
+        (que, na importação, também contém a troca da tabela).
+        """
+        # Índices funcionais substituídos pelos das colunas normalizadas (o planner não usa um pelo outro)
+        for nome_idx in self.INDICES_OBSOLETOS:
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(f"DROP INDEX IF EXISTS {nome_idx}"))
+            except Exception as e:
+                logger.warning("Não foi possível remover índice %s: %s", nome_idx, e)
+        
+        # Lista de índices a serem criados: (nome, expressão, predicado do índice parcial ou None)
+        registros_ativos = "estado_norm <> 'prog'"
+        indices = [
+            ("idx_bd_norm_criterio", "criterio_norm", None),
+            ("idx_bd_norm_pt", "pt_norm", None),
+            ("idx_bd_norm_localidade", "localidade_norm", None),
+            ("idx_bd_norm_estado", "estado_norm", None),
+            ("idx_bd_norm_anomalia", "anomalia_norm", None),
+            ("idx_bd_norm_est_contr", "est_contr_norm", None),
+            ("idx_bd_norm_sit_div", "sit_div_norm", None),
+            ("idx_bd_norm_est_inspec", "est_inspec_norm", None),
+            ("idx_bd_norm_desv", "desv_norm", None),
+            ("idx_bd_norm_desc_tp_cli", "desc_tp_cli_norm", None),
+            ("idx_bd_nib_clean", "TRIM(nib)", None),
+            # Registros ainda não programados: predicado fixo de gerar_folhas_trabalho
+            ("idx_bd_nib_ativo", "nib", registros_ativos),
+            ("idx_bd_ativo_pt", "pt_norm, nib", registros_ativos),
+            ("idx_bd_ativo_localidade", "localidade_norm, nib", registros_ativos),
+            # Registros em 'prog': contagens por PT (views do dashboard) e o reset de estado
+            ("idx_bd_prog", "pt_norm", "estado_norm = 'prog'"),
+            # Cobertura (INCLUDE): agregações por PT/localidade das views do dashboard com index-only scan
+            ("idx_bd_pt_id_cov", "pt_id", "pt_id IS NOT NULL", "valor, estado_norm"),
+            ("idx_bd_localidade_id_cov", "localidade_id", "localidade_id IS NOT NULL", "valor")
+        ]
+        
+        # Índices já existentes (no startup, normalmente todos): só os que faltam são criados
+        existentes = set(conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = 'bd'")
+        ).scalars())
+        criou_indice = False
+        for nome_idx, expressao, predicado, *incluir in indices:
+            if nome_idx in existentes:
+                continue
+            include = f" INCLUDE ({incluir[0]})" if incluir else ""
+            where = f" WHERE {predicado}" if predicado else ""
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {nome_idx} ON bd ({expressao}){include}{where}"))
+                criou_indice = True
+            except Exception as e:
+                logger.warning("Não foi possível criar índice %s: %s", nome_idx, e)
+        
+        # Estatísticas para o planner só quando algum índice foi criado (inclui a tabela nova da importação),
+        # não a cada início do processo
+        if criou_indice:
+            try:
+                with conn.begin_nested():
+                    conn.execute(text("ANALYZE bd"))
+            except Exception as e:
+                logger.warning("Não foi possível analisar a tabela bd: %s", e)
+        
+        try:
+            with conn.begin_nested():
+                self._criar_view_valores_unicos(conn)
+        except Exception as e:
+            logger.warning("Não foi possível criar a view bd_distinct_values: %s", e)
+        
+        self._criar_views_dashboard(conn)
+
+    # Colunas servidas pela materialized view bd_distinct_values (filtros do dashboard e das folhas)
+    COLUNAS_VALORES_UNICOS = (
+        'criterio', 'anomalia', 'est_contr', 'sit_div', 'est_inspec',
+        'desv', 'desc_tp_cli', 'pt', 'localidade'
+    )
+
+    def _criar_view_valores_unicos(self, conn):
+        """Cria a materialized view (coluna, valor) com os valores distintos de COLUNAS_VALORES_UNICOS."""
+        partes = []
+        for coluna in self.COLUNAS_VALORES_UNICOS:
+            valor = self._expressao_normalizada(coluna)
+            partes.append(f"""
+                SELECT DISTINCT '{coluna}' AS coluna, {valor} AS valor
+                FROM bd
+                WHERE {valor} IS NOT NULL
+                AND {valor} != ''
+                AND {valor} NOT IN ('NONE', 'NULL')
+            """)
+        conn.execute(text(
+            "CREATE MATERIALIZED VIEW IF NOT EXISTS bd_distinct_values AS " + " UNION ALL ".join(partes)
+        ))
+        # Índice único (coluna, valor): usado na busca por coluna e permite REFRESH ... CONCURRENTLY
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_bd_distinct_values ON bd_distinct_values (coluna, valor)"
+        ))
+
+    def limpar_cache_valores_unicos(self):
+        """Descarta o dicionário de valores únicos compartilhado entre as sessões."""
+        PostgresDatabaseManager._valores_unicos_por_coluna.clear()
+
+    # Agregações do dashboard pré-calculadas em materialized views: {nome base: (SELECT, chave única)}.
+    # A chave única permite REFRESH ... CONCURRENTLY (leituras continuam durante a atualização).
+    VIEWS_DASHBOARD = {
+        'stats': ("""
+            SELECT 
+                1 as chave,
+                COUNT(*) as total_registros,
+                COUNT(DISTINCT cil) as cils_unicos,
+                COUNT(DISTINCT pt) as pts_unicos,
+                COUNT(DISTINCT localidade) as localidades_unicas,
+                COUNT(DISTINCT nib) as nibs_unicos,
+                COUNT(*) FILTER (WHERE estado_norm = 'prog') as registros_em_progresso,
+                SUM(qtd) as total_qtd,
+                SUM(valor) as total_valor,
+                AVG(qtd) as media_qtd,
+                AVG(valor) as media_valor
+            FROM bd
+        """, "chave"),
+        # Só os 15 PTs exibidos: HAVING, ORDER BY e LIMIT resolvidos no refresh, não a cada leitura
+        # Agrupadas pela chave inteira (pt_id/localidade_id); o texto só volta pelo join com a dimensão no fim
+        'top_pt': ("""
+            SELECT 
+                d.pt_norm as pt,
+                b.total_registros, b.em_progresso, b.percentual_progresso, b.valor_total, b.valor_medio
+            FROM (
+                SELECT 
+                    pt_id,
+                    COUNT(*) as total_registros,
+                    COUNT(*) FILTER (WHERE estado_norm = 'prog') as em_progresso,
+                    ROUND(COUNT(*) FILTER (WHERE estado_norm = 'prog') * 100.0 / COUNT(*), 2) as percentual_progresso,
+                    SUM(valor) as valor_total,
+                    AVG(valor) as valor_medio
+                FROM bd
+                WHERE pt_id IS NOT NULL
+                GROUP BY pt_id
+                HAVING COUNT(*) > 10
+                ORDER BY total_registros DESC
+                LIMIT 15
+            ) b
+            JOIN dim_pt d USING (pt_id)
+        """, "pt"),
+        'top_localidades': ("""
+            SELECT 
+                d.localidade_norm as localidade,
+                b.total_registros, b.valor_total, b.valor_medio
+            FROM (
+                SELECT 
+                    localidade_id,
+                    COUNT(*) as total_registros,
+                    SUM(valor) as valor_total,
+                    AVG(valor) as valor_medio
+                FROM bd
+                WHERE localidade_id IS NOT NULL
+                GROUP BY localidade_id
+            ) b
+            JOIN dim_localidade d USING (localidade_id)
+        """, "localidade"),
+        # Coordenadas agrupadas em células de 0,01 grau (o mapa lê uma linha por célula, não por ponto)
+        'geoloc': ("""
+            SELECT 
+                ROUND(lat::numeric, 2)::double precision as lat,
+                ROUND(long::numeric, 2)::double precision as long,
+                COUNT(*) as densidade,
+                SUM(valor) as valor_total
+            FROM bd
+            WHERE lat IS NOT NULL AND long IS NOT NULL 
+            AND lat != 0 AND long != 0
+            GROUP BY ROUND(lat::numeric, 2), ROUND(long::numeric, 2)
+        """, "lat, long")
+    }
+
+    # Critérios do dashboard -> coluna da BD; todas as distribuições ficam numa única view (dim, val)
+    MAPEAMENTO_DASHBOARD = {
+        'Criterio': 'criterio',
+        'Anomalia': 'anomalia',
+        'EST_CTR': 'est_contr',
+        'sit_div': 'sit_div', 
+        'est_inspec': 'est_inspec',
+        'desv': 'desv'
+    }
+    VIEWS_DASHBOARD['criterio_rollup'] = (" UNION ALL ".join(f"""
+            SELECT 
+                '{dim}' as dim,
+                {coluna}_norm as val,
+                COUNT(*) as quantidade,
+                SUM(valor) as total_valor,
+                AVG(valor) as valor_medio
+            FROM bd
+            WHERE {coluna}_norm IS NOT NULL AND {coluna}_norm != ''
+            GROUP BY {coluna}_norm
+        """ for dim, coluna in MAPEAMENTO_DASHBOARD.items()), "dim, val")
+
+    # Contagens distintas aproximadas (HyperLogLog, extensão hll) para as colunas de alta cardinalidade;
+    # localidades seguem exatas (poucos valores). Usada no lugar de 'stats' quando a extensão existe.
+    STATS_HLL = """
+            SELECT 
+                1 as chave,
+                COUNT(*) as total_registros,
+                ROUND(hll_cardinality(hll_add_agg(hll_hash_text(cil))))::bigint as cils_unicos,
+                ROUND(hll_cardinality(hll_add_agg(hll_hash_text(pt))))::bigint as pts_unicos,
+                COUNT(DISTINCT localidade) as localidades_unicas,
+                ROUND(hll_cardinality(hll_add_agg(hll_hash_text(nib))))::bigint as nibs_unicos,
+                COUNT(*) FILTER (WHERE estado_norm = 'prog') as registros_em_progresso,
+                SUM(qtd) as total_qtd,
+                SUM(valor) as total_valor,
+                AVG(qtd) as media_qtd,
+                AVG(valor) as media_valor
+            FROM bd
+        """
+
+    def _ativar_hll(self, conn):
+        """Usa STATS_HLL na view de estatísticas se a extensão hll puder ser habilitada; senão mantém COUNT(DISTINCT)."""
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS hll"))
+        except Exception as e:
+            logger.info("Extensão hll indisponível, estatísticas com COUNT(DISTINCT): %s", e)
+            return
+        # A definição muda o hash do nome: a view HLL é criada e a exata é descartada como obsoleta
+        self.VIEWS_DASHBOARD['stats'] = (self.STATS_HLL, "chave")
+
+    def _nome_view(self, base):
+        """Nome da view com o hash do SELECT: mudar a definição cria uma view nova em vez de ler a antiga."""
+        definicao = self.VIEWS_DASHBOARD[base][0]
+        return f"mv_bd_{base}_{hashlib.blake2b(definicao.encode('utf-8'), digest_size=4).hexdigest()}"
+
+    def _criar_views_dashboard(self, conn):
+        """Cria (se não existirem) as views de VIEWS_DASHBOARD e seus índices únicos, cada uma num savepoint."""
+        self._ativar_hll(conn)
+        for base, (definicao, chave) in self.VIEWS_DASHBOARD.items():
+            nome = self._nome_view(base)
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {nome} AS {definicao}"))
+                    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{nome} ON {nome} ({chave})"))
+            except Exception as e:
+                logger.warning("Não foi possível criar a view %s: %s", nome, e)
+        
+        # Views de definições anteriores (hash diferente) não são mais lidas nem atualizadas
+        atuais = {self._nome_view(base) for base in self.VIEWS_DASHBOARD}
+        existentes = conn.execute(text(
+            "SELECT matviewname FROM pg_matviews "
+            "WHERE schemaname = current_schema() AND left(matviewname, 6) = 'mv_bd_'"
+        )).scalars().all()
+        for nome in set(existentes) - atuais:
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {nome}"))
+                logger.info("View obsoleta %s removida", nome)
+            except Exception as e:
+                logger.warning("Não foi possível remover a view obsoleta %s: %s", nome, e)
+
+    def atualizar_views_dashboard(self):
+        """Recalcula as views do dashboard após mudanças de estado e descarta os caches que as leem."""
+        try:
+            with self.engine.connect() as conn:
+                self._sem_limite_de_tempo(conn)
+                for base in self.VIEWS_DASHBOARD:
+                    conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {self._nome_view(base)}"))
+                conn.commit()
         except Exception as e:
-            logger.error(f"Erro ao criar índices: {e}")
+            logger.warning("Não foi possível atualizar as views do dashboard: %s", e)
+        self._limpar_cache_dashboard()
+
+    def _limpar_cache_dashboard(self):
+        """Invalida os caches (memória e disco) das consultas de dashboard e relatório."""
+        PostgresDatabaseManager.obter_estatisticas_gerais.clear()
+        PostgresDatabaseManager.obter_metricas_operacionais.clear()
+        PostgresDatabaseManager._rollup_dashboard.clear()
+        PostgresDatabaseManager.obter_dados_para_dashboard.clear()
+        PostgresDatabaseManager.gerar_relatorio_detalhado.clear()
+        self._limpar_cache_relatorios()
+
+    def _prefetch_all(self):
+        """Preenche os caches do dashboard com as mesmas chamadas (e argumentos) que a UI faz.
+        
+        O st.cache_data é chaveado pelos argumentos como passados, por isso (criterio, None) e
+        top_n=8 repetem exatamente as chamadas de dashboard.py. Roda em _REFRESH_POOL, fora de
+        qualquer sessão: as funções em cache usam show_spinner=False e não emitem elementos.
+        """
+        try:
+            inicio = time.perf_counter()
+            self.obter_estatisticas_gerais()
+            self.obter_metricas_operacionais()
+            for criterio in self.MAPEAMENTO_DASHBOARD:
+                self.obter_dados_para_dashboard(criterio, None)
+                self.obter_dados_para_dashboard(criterio, None, top_n=8)
+            logger.info("Caches do dashboard aquecidos em %.2fs", time.perf_counter() - inicio)
+        except Exception as e:
+            logger.warning("Falha ao aquecer os caches do dashboard: %s", e)
+
+    def _caminho_cache_relatorio(self, sql, params):
+        """Arquivo Parquet do relatório, identificado pelo hash de (SQL, parâmetros)."""
+        chave = hashlib.blake2b(
+            json.dumps([sql, params], sort_keys=True, default=str).encode('utf-8'), digest_size=16
+        ).hexdigest()
+        return os.path.join(RELATORIOS_CACHE_DIR, f"{chave}.parquet")
+
+    def _ler_cache_relatorio(self, caminho):
+        """DataFrame (dtypes Arrow) do cache se o arquivo existir e tiver menos de RELATORIOS_CACHE_TTL_S; senão None."""
+        try:
+            if time.time() - os.path.getmtime(caminho) < RELATORIOS_CACHE_TTL_S:
+                return pd.read_parquet(caminho, dtype_backend='pyarrow')
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Cache de relatório ilegível (%s): %s", caminho, e)
+        return None
+
+    def _gravar_cache_relatorio(self, caminho, df):
+        """Grava o relatório em Parquet (arquivo temporário + rename, para leitores nunca verem meio arquivo)."""
+        try:
+            os.makedirs(RELATORIOS_CACHE_DIR, exist_ok=True)
+            temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+            df.to_parquet(temporario, index=False)
+            os.replace(temporario, caminho)
+        except Exception as e:
+            logger.warning("Não foi possível gravar o cache de relatório: %s", e)
+
+    def _limpar_cache_relatorios(self):
+        """Remove os relatórios em Parquet (dados mudaram)."""
+        try:
+            with os.scandir(RELATORIOS_CACHE_DIR) as arquivos:
+                for arquivo in arquivos:
+                    if arquivo.name.endswith('.parquet'):
+                        os.remove(arquivo.path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Não foi possível limpar o cache de relatórios: %s", e)
+
+    # Colunas da tabela BD na ordem do arquivo CSV (sem cabeçalho)
+    COLUNAS_BD = [
+        'cil', 'prod', 'contador', 'leitura', 'mat_contador',
+        'med_fat', 'qtd', 'valor', 'situacao', 'acordo',
+        'nib', 'seq', 'localidade', 'pt', 'desv',
+        'mat_leitura', 'desc_uni', 'est_contr', 'anomalia', 'id',
+        'produto', 'nome', 'criterio', 'desc_tp_cli', 'tip',
+        'sit_div', 'modelo', 'lat', 'long', 'est_inspec',
+        'estado'
+    ]
+    COLUNAS_BD_NUMERICAS = {'qtd', 'valor', 'lat', 'long'}
+    COLUNAS_BD_MAIUSCULAS = {'criterio', 'pt', 'localidade'}
+    COLUNAS_BD_MINUSCULAS = {'estado'}
+    
+    # Mesmo critério do pd.to_numeric: o que não for número vira 0
+    REGEX_NUMERO = r'^[+-]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][+-]?[0-9]+)?$'
+
+    def _expressao_importacao(self, coluna, indice):
+        """Expressão SQL que limpa a coluna bruta c{indice} da staging para a coluna da BD."""
+        bruto = f"TRIM(c{indice})"
+        if coluna in self.COLUNAS_BD_NUMERICAS:
+            return f"CASE WHEN {bruto} ~ '{self.REGEX_NUMERO}' THEN CAST({bruto} AS DOUBLE PRECISION) ELSE 0 END"
+        expressao = f"COALESCE({bruto}, '')"
+        if coluna in self.COLUNAS_BD_MAIUSCULAS:
+            return f"UPPER({expressao})"
+        if coluna in self.COLUNAS_BD_MINUSCULAS:
+            return f"LOWER({expressao})"
+        return expressao
+
+    def _contar_colunas_csv(self, amostra, encoding, separador):
+        """Conta os campos da primeira linha da amostra (respeitando aspas)."""
+        primeira_linha = amostra.split(b'\n', 1)[0].decode(encoding, errors='ignore')
+        return len(next(csv.reader([primeira_linha], delimiter=separador), []))
+
+    def _fluxo_utf8(self, arquivo_csv, encoding):
+        """Retorna o upload como fluxo UTF-8 para o COPY, convertendo em blocos se necessário."""
+        arquivo_csv.seek(0)
+        nome = codecs.lookup(encoding).name
+        if nome in ('utf-8', 'ascii'):
+            return arquivo_csv
+        # Outros encodings (incl. utf-8-sig, que remove o BOM): recodifica à medida que o COPY lê
+        return codecs.EncodedFile(arquivo_csv, 'utf-8', nome)
 
     def importar_csv(self, arquivo_csv, tabela='BD', colunas_esperadas=31):
-        """Importa dados do CSV para a tabela BD do PostgreSQL usando COPY (Alta Performance)."""
+        """Importa dados do CSV para a tabela BD do PostgreSQL usando COPY (Alta Performance).
+        
+        O upload vai direto para uma staging só de TEXT via COPY; limpeza, normalização e
+        conversão numérica são feitas num único INSERT ... SELECT no banco.
+        """
         try:
-            # 1. Detecção e Leitura com Pandas (para limpeza inicial)
-            encoding = self._detectar_encoding(arquivo_csv)
-            separador = self._detectar_separador(arquivo_csv, encoding)
+            # 1. Detecção do formato (encoding, separador e número de colunas)
+            amostra = self._amostra_csv(arquivo_csv)
+            encoding = self._detectar_encoding(amostra)
+            separador = self._detectar_separador(amostra, encoding)
 
             if tabela == 'BD':
-                # Ler com Pandas para garantir a estrutura correta
-                df_novo = pd.read_csv(arquivo_csv, sep=separador, encoding=encoding, 
-                                      on_bad_lines='skip', header=None, low_memory=False) 
+                num_colunas = self._contar_colunas_csv(amostra, encoding, separador)
                 
-                if len(df_novo.columns) < colunas_esperadas:
-                    st.error(f"❌ O arquivo BD deve ter pelo menos {colunas_esperadas} colunas. Encontradas: {len(df_novo.columns)}")
+                if num_colunas < colunas_esperadas:
+                    st.error(f"❌ O arquivo BD deve ter pelo menos {colunas_esperadas} colunas. Encontradas: {num_colunas}")
                     return False
                 
-                # Mapeamento de colunas
-                column_mapping = {
-                    0: 'cil', 1: 'prod', 2: 'contador', 3: 'leitura', 4: 'mat_contador',
-                    5: 'med_fat', 6: 'qtd', 7: 'valor', 8: 'situacao', 9: 'acordo',
-                    10: 'nib', 11: 'seq', 12: 'localidade', 13: 'pt', 14: 'desv',
-                    15: 'mat_leitura', 16: 'desc_uni', 17: 'est_contr', 18: 'anomalia', 19: 'id',
-                    20: 'produto', 21: 'nome', 22: 'criterio', 23: 'desc_tp_cli', 24: 'tip',
-                    25: 'sit_div', 26: 'modelo', 27: 'lat', 28: 'long', 29: 'est_inspec',
-                    30: 'estado'
-                }
-                
-                df_novo.rename(columns=column_mapping, inplace=True)
-                
-                # 2. Tratamento e Limpeza
-                # Converter para string e limpar espaços
-                cols_str = ['criterio', 'pt', 'localidade', 'nib', 'cil', 'estado', 
-                           'prod', 'contador', 'leitura', 'mat_contador', 'med_fat', 
-                           'situacao', 'acordo', 'seq', 'desv', 'mat_leitura', 
-                           'desc_uni', 'est_contr', 'anomalia', 'id', 'produto', 
-                           'nome', 'desc_tp_cli', 'tip', 'sit_div', 'modelo', 'est_inspec']
-                
-                for col in cols_str:
-                    if col in df_novo.columns:
-                        df_novo[col] = df_novo[col].fillna('').astype(str).str.strip()
-
-                # Normalização de texto
-                df_novo['criterio'] = df_novo['criterio'].str.upper()
-                df_novo['pt'] = df_novo['pt'].str.upper()
-                df_novo['localidade'] = df_novo['localidade'].str.upper()
-                df_novo['estado'] = df_novo['estado'].str.lower()
-                
-                # Tratamento de Numéricos
-                df_novo['qtd'] = pd.to_numeric(df_novo['qtd'], errors='coerce').fillna(0)
-                df_novo['valor'] = pd.to_numeric(df_novo['valor'], errors='coerce').fillna(0)
-                df_novo['lat'] = pd.to_numeric(df_novo['lat'], errors='coerce').fillna(0)
-                df_novo['long'] = pd.to_numeric(df_novo['long'], errors='coerce').fillna(0)
-                
-                # Garantir ordem das colunas conforme a tabela SQL
-                colunas_sql = [
-                    'cil', 'prod', 'contador', 'leitura', 'mat_contador',
-                    'med_fat', 'qtd', 'valor', 'situacao', 'acordo',
-                    'nib', 'seq', 'localidade', 'pt', 'desv',
-                    'mat_leitura', 'desc_uni', 'est_contr', 'anomalia', 'id',
-                    'produto', 'nome', 'criterio', 'desc_tp_cli', 'tip',
-                    'sit_div', 'modelo', 'lat', 'long', 'est_inspec',
-                    'estado'
-                ]
-                
-                # Preencher colunas faltantes se houver
-                for col in colunas_sql:
-                    if col not in df_novo.columns:
-                        df_novo[col] = None
-                        
-                df_final = df_novo[colunas_sql]
+                # 2. Tratamento e Limpeza no SQL (colunas extras do arquivo são ignoradas)
+                expressoes = ",\n".join(
+                    self._expressao_importacao(coluna, i) for i, coluna in enumerate(self.COLUNAS_BD)
+                )
+                colunas_stage = ", ".join(f"c{i} TEXT" for i in range(num_colunas))
 
                 # 3. Operações no BD com COPY
                 with self.engine.connect() as conn:
+                    self._sem_limite_de_tempo(conn)
+                    
                     # Usar conexão raw para acesso ao copy_expert
                     # SQLAlchemy >= 1.4 expõe a conexão DBAPI via .connection.cursor()
                     raw_conn = conn.connection
                     cursor = raw_conn.cursor()
                     
-                    # Criar tabela temporária (estrutura vazia baseada na real)
-                    conn.execute(text("CREATE TEMP TABLE IF NOT EXISTS bd_temp_import (LIKE bd INCLUDING ALL)"))
-                    conn.execute(text("TRUNCATE TABLE bd_temp_import"))
+                    # Staging bruta (tudo TEXT, descartada no commit) e a nova BD, que substituirá bd por rename
+                    conn.execute(text(f"CREATE TEMP TABLE bd_stage_raw ({colunas_stage}) ON COMMIT DROP"))
+                    conn.execute(text("DROP TABLE IF EXISTS bd_new"))
+                    conn.execute(text("CREATE TABLE bd_new (LIKE bd INCLUDING DEFAULTS INCLUDING GENERATED)"))
                     
-                    # Converter DataFrame para CSV em memória
-                    output = io.StringIO()
-                    df_final.to_csv(output, sep='\t', header=False, index=False, quoting=csv.QUOTE_MINIMAL)
-                    output.seek(0)
-                    
-                    # Executar COPY
+                    # Executar COPY lendo o upload em blocos, sem passar pelo pandas. Se alguma linha
+                    # tiver outro número de campos ou bytes inválidos no encoding (ex.: Latin-1 depois
+                    # da amostra), o COPY falha inteiro: o savepoint é desfeito e o arquivo é reenviado
+                    # filtrado (linhas com campos a mais descartadas, bytes inválidos lidos como Latin-1)
+                    copy_sql = f"COPY bd_stage_raw FROM STDIN WITH (FORMAT CSV, DELIMITER '{separador}', ENCODING 'UTF8', HEADER FALSE)"
                     try:
-                        cursor.copy_expert("COPY bd_temp_import FROM STDIN WITH (FORMAT CSV, DELIMITER '\t', NULL '')", output)
-                        logger.info("Dados copiados para tabela temporária via COPY")
-                    except Exception as e:
-                        raw_conn.rollback()
-                        raise e
+                        with conn.begin_nested():
+                            cursor.copy_expert(copy_sql, self._fluxo_utf8(arquivo_csv, encoding))
+                        logger.info("Dados copiados para a staging via COPY")
+                    except psycopg2.DataError as e:
+                        logger.info("COPY direto rejeitado (%s); reenviando o arquivo filtrado", e)
+                        fluxo = _FluxoCsvFiltrado(arquivo_csv, encoding, separador, num_colunas, erros='latin1_fallback')
+                        cursor.copy_expert(copy_sql, fluxo)
+                        if fluxo.descartadas:
+                            st.warning(f"⚠️ {fluxo.descartadas} linha(s) com mais de {num_colunas} campos foram ignoradas.")
+                        logger.info("Dados copiados para a staging via COPY filtrado (%s linhas descartadas)", fluxo.descartadas)
+                    
+                    # Valores novos de PT/localidade registrados a partir da staging; as chaves
+                    # inteiras entram no mesmo INSERT (sem um UPDATE que reescreveria cada linha)
+                    normalizadas = {
+                        coluna: f"UPPER(TRIM({self._expressao_importacao(coluna, self.COLUNAS_BD.index(coluna))}))"
+                        for coluna in self.DIMENSOES
+                    }
+                    self._registrar_valores_dimensoes(conn, 'bd_stage_raw', normalizadas)
+                    chaves = ", ".join(f"{coluna}_id" for coluna in self.DIMENSOES)
+                    juncoes = "\n".join(
+                        f"LEFT JOIN {dimensao} ON {dimensao}.{coluna}_norm = {normalizadas[coluna]}"
+                        for coluna, dimensao in self.DIMENSOES.items()
+                    )
+                    result = conn.execute(text(f"""
+                        INSERT INTO bd_new ({", ".join(self.COLUNAS_BD)}, {chaves})
+                        SELECT {expressoes}, {chaves}
+                        FROM bd_stage_raw
+                        {juncoes}
+                    """))
+                    total_importado = result.rowcount
                     
-                    # Preservar estado 'prog' existente
+                    # Preservar estado 'prog' existente: snapshot pequeno (só os CILs em 'prog'),
+                    # indexado e analisado, para o planner fazer um hash join em vez de varrer a BD
+                    conn.execute(text("""
+                        CREATE TEMP TABLE prog_snap ON COMMIT DROP AS
+                        SELECT DISTINCT cil FROM bd WHERE estado = 'prog'
+                    """))
+                    conn.execute(text("CREATE INDEX ON prog_snap (cil)"))
+                    conn.execute(text("ANALYZE prog_snap"))
                     update_query = text("""
-                        UPDATE bd_temp_import as new 
+                        UPDATE bd_new as new 
                         SET estado = 'prog' 
-                        FROM bd as old
-                        WHERE new.cil = old.cil AND old.estado = 'prog'
+                        FROM prog_snap
+                        WHERE new.cil = prog_snap.cil
                     """)
                     result = conn.execute(update_query)
                     st.info(f"O estado 'prog' foi preservado para {result.rowcount} registro(s) durante a importação.")
                     
-                    # Substituir a tabela BD
-                    conn.execute(text("TRUNCATE TABLE bd"))
-                    conn.execute(text("INSERT INTO bd SELECT * FROM bd_temp_import"))
-                    conn.execute(text("DROP TABLE bd_temp_import"))
+                    # Substituir a tabela BD por rename (só metadados, sem copiar as linhas de novo).
+                    # As materialized views dependem da tabela antiga (CASCADE) e são recriadas,
+                    # com os índices, sobre a nova.
+                    conn.execute(text("ALTER TABLE bd RENAME TO bd_old"))
+                    conn.execute(text("ALTER TABLE bd_new RENAME TO bd"))
+                    conn.execute(text("DROP TABLE bd_old CASCADE"))
+                    self._criar_indices(conn)
                     
                     conn.commit()
 
-                # Criar índices após a carga massiva
-                self.criar_indices_performance()
+                # As views já nascem com os dados novos; só os caches precisam ser descartados
+                self.limpar_cache_valores_unicos()
+                self._limpar_cache_dashboard()
                 
-                logger.info(f"CSV importado com sucesso: {len(df_novo)} registros")
+                logger.info("CSV importado com sucesso: %s registros", total_importado)
                 return True
             
         except Exception as e:
@@ -472,14 +1346,43 @@ class PostgresDatabaseManager:
         st.info("ℹ️ Ordenação da tabela BD física desabilitada para otimização de performance.")
         return True
 
+    @st.cache_resource(ttl=3600, show_spinner=False)
+    def _valores_unicos_por_coluna(_self):
+        """Carrega bd_distinct_values num dict {coluna: [valores]} compartilhado entre as sessões.
+        
+        cache_resource não serializa o resultado: quem consulta recebe cópias das listas.
+        """
+        valores = {coluna: [] for coluna in _self.COLUNAS_VALORES_UNICOS}
+        with _self.engine.connect() as conn:
+            if conn.execute(text("SELECT to_regclass('bd_distinct_values')")).scalar() is None:
+                # Base anterior à view: cria uma única vez (a carga inicial varre a BD)
+                _self._sem_limite_de_tempo(conn)
+                _self._criar_view_valores_unicos(conn)
+                conn.commit()
+            rows = conn.execute(text("SELECT coluna, valor FROM bd_distinct_values ORDER BY coluna, valor"))
+            for coluna, valor in rows:
+                valores.setdefault(coluna, []).append(valor)
+        logger.debug("Valores únicos carregados de bd_distinct_values: %s colunas", len(valores))
+        return valores
+
+    def obter_valores_unicos(self, coluna, tabela='bd'):
+        """Obtém valores únicos de uma coluna a partir da view bd_distinct_values (cache compartilhado)."""
+        # Usa o nome mapeado ou o original se não estiver no mapeamento
+        coluna_sql = self.MAPEAMENTO_COLUNAS.get(coluna.lower(), coluna.lower())
+        if tabela != 'bd' or coluna_sql not in self.COLUNAS_VALORES_UNICOS:
+            return self._valores_unicos_distinct(coluna, coluna_sql, tabela)
+        try:
+            # Cópia: os chamadores inserem "Selecione..." na lista
+            return list(self._valores_unicos_por_coluna()[coluna_sql])
+        except Exception as e:
+            st.error(f"❌ Erro ao obter valores únicos para {coluna}: {e}")
+            return []
+
     @st.cache_data(ttl=3600, show_spinner=False)
-    def obter_valores_unicos(_self, coluna, tabela='bd'):
-        """Obtém valores únicos de uma coluna, com cache para melhor performance."""
+    def _valores_unicos_distinct(_self, coluna, coluna_sql, tabela):
+        """SELECT DISTINCT direto na tabela, para colunas fora de bd_distinct_values."""
         try:
-            with _self.engine.connect() as conn:
-                # Usa o nome mapeado ou o original se não estiver no mapeamento
-                coluna_sql = _self.MAPEAMENTO_COLUNAS.get(coluna.lower(), coluna.lower())
-                    
+            with _self._conectar_leitura() as conn:
                 query = text(f"""
                     SELECT DISTINCT UPPER(TRIM({coluna_sql})) as valor_unico
                     FROM {tabela} 
@@ -491,110 +1394,146 @@ class PostgresDatabaseManager:
                 
                 df = pd.read_sql_query(query, conn)
                 valores = df['valor_unico'].tolist()
-                logger.debug(f"Valores únicos obtidos para {coluna}: {len(valores)} valores")
+                logger.debug("Valores únicos obtidos para %s: %s valores", coluna, len(valores))
                 return valores
         except Exception as e:
             st.error(f"❌ Erro ao obter valores únicos para {coluna}: {e}")
             return []
 
+    def obter_valores_unicos_multi(self, colunas, tabela='bd'):
+        """Obtém os valores únicos de várias colunas de uma vez (mesmo cache de obter_valores_unicos)."""
+        return {coluna: self.obter_valores_unicos(coluna, tabela) for coluna in colunas}
+
     def gerar_folhas_trabalho(self, tipo_folha, valor_selecionado, quantidade_folhas, quantidade_nibs, cils_validos=None, criterio_tipo=None, criterio_valor=None):
         """Gera folhas de trabalho com filtragem e ordenação no SQL."""
         try:
             with self.engine.connect() as conn:
+                self._sem_limite_de_tempo(conn)
                 
                 cils_restantes_nao_encontrados = []
                 
                 # 1. Construção da Query
-                select_clause = "SELECT * FROM bd"
-                where_conditions = ["LOWER(TRIM(estado)) != 'prog'"]
+                where_conditions = ["estado_norm != 'prog'"]
                 query_params = {}
                 
                 # Adicionar critério de seleção
                 if criterio_tipo and criterio_valor:
                     coluna_criterio = self.MAPEAMENTO_CRITERIOS.get(criterio_tipo)
                     if coluna_criterio:
-                        where_conditions.append(f"UPPER(TRIM({coluna_criterio})) = :criterio_valor")
+                        where_conditions.append(f"{self._expressao_normalizada(coluna_criterio)} = :criterio_valor")
                         query_params['criterio_valor'] = criterio_valor.strip().upper()
 
                 # Condições específicas por tipo de folha
                 if tipo_folha == "AVULSO" and cils_validos:
+                    # Lista inteira numa única consulta (array do psycopg2), sem vazios nem repetidos
+                    cils_validos = list(dict.fromkeys(c.strip() for c in cils_validos if c and c.strip()))
                     where_conditions.append("cil = ANY(:cils)")
                     query_params['cils'] = cils_validos
                 elif valor_selecionado:
                     valor_selecionado_limpo = valor_selecionado.strip().upper()
                     coluna_filtro = 'pt' if tipo_folha == "PT" else 'localidade'
-                    where_conditions.append(f"UPPER(TRIM({coluna_filtro})) = :valor_filtro")
+                    where_conditions.append(f"{coluna_filtro}_norm = :valor_filtro")
                     query_params['valor_filtro'] = valor_selecionado_limpo
                 
                 # 2. Ordenação
-                order_by_clause = """
-                    ORDER BY 
+                ordenacao = """
                         CASE WHEN seq IS NULL OR TRIM(seq) = '' THEN 1 ELSE 0 END, seq,
                         CASE WHEN nib IS NULL OR TRIM(nib) = '' THEN 1 ELSE 0 END, nib
                 """
-                full_query = f"{select_clause} WHERE {' AND '.join(where_conditions)} {order_by_clause}"
-                
-                df = pd.read_sql_query(text(full_query), conn, params=query_params)
+                where_clause = ' AND '.join(where_conditions)
 
                 if tipo_folha == "AVULSO" and cils_validos:
-                    cils_encontrados = set(df['cil'].unique()) if not df.empty else set()
-                    cils_restantes_nao_encontrados = list(set(cils_validos) - cils_encontrados)
-
-                if df.empty:
-                    return None, cils_restantes_nao_encontrados
+                    # Diferença vetorizada (uma passada de hash via Index.isin), na ordem do arquivo
+                    cils_encontrados = conn.execute(
+                        text(f"SELECT DISTINCT cil FROM bd WHERE {where_clause}"), query_params
+                    ).scalars().all()
+                    cils_pedidos = pd.Index(cils_validos)
+                    cils_restantes_nao_encontrados = cils_pedidos[~cils_pedidos.isin(cils_encontrados)].tolist()
                 
-                # 3. Geração das Folhas
-                df['nib'] = df['nib'].fillna('').astype(str).str.strip()
-                nibs_unicos = df['nib'].unique()
+                # 3. Escolha dos NIBs no servidor: os primeiros (na ordenação acima) que cabem nas folhas.
+                # Só as linhas desses NIBs chegam ao Python, qualquer que seja o tamanho do filtro.
+                nibs_query = text(f"""
+                    SELECT nib_limpo FROM (
+                        SELECT COALESCE(TRIM(nib), '') AS nib_limpo, ROW_NUMBER() OVER (ORDER BY {ordenacao}) AS ordem
+                        FROM bd WHERE {where_clause}
+                    ) t
+                    GROUP BY nib_limpo
+                    ORDER BY MIN(ordem)
+                    LIMIT :limite_nibs
+                """)
+                nibs_unicos = conn.execute(
+                    nibs_query, {**query_params, 'limite_nibs': quantidade_folhas * quantidade_nibs}
+                ).scalars().all()
                 total_nibs = len(nibs_unicos)
                 
                 if total_nibs == 0:
                     return None, cils_restantes_nao_encontrados
                 
+                # Só as colunas do arquivo (as *_norm são internas). O número da folha vem da posição do NIB
+                # na lista escolhida, casada pela mesma normalização COALESCE(TRIM(nib), '') da escolha
+                full_query = f"""
+                    SELECT {', '.join(self.COLUNAS_BD)}, (escolha.ordem - 1) / :quantidade_nibs + 1 AS "FOLHA"
+                    FROM bd
+                    JOIN unnest(CAST(:nibs_escolhidos AS text[])) WITH ORDINALITY AS escolha(nib_limpo, ordem)
+                        ON COALESCE(TRIM(bd.nib), '') = escolha.nib_limpo
+                    WHERE {where_clause}
+                    ORDER BY "FOLHA", {ordenacao}
+                """
+                query_params['nibs_escolhidos'] = nibs_unicos
+                query_params['quantidade_nibs'] = quantidade_nibs
+                
+                if CONNECTORX_AVAILABLE:
+                    df = self._ler_arrow(conn, full_query, query_params)
+                else:
+                    df = self._ler_em_blocos(conn, full_query, query_params)
+
+                if df.empty:
+                    return None, cils_restantes_nao_encontrados
+                
+                # 4. Geração das Folhas
+                # String Arrow: fillna/strip rodam em kernels do pyarrow, sem um objeto Python por célula
+                df['nib'] = df['nib'].astype('string[pyarrow]').fillna('').str.strip()
+                
                 folhas_possiveis = (total_nibs + quantidade_nibs - 1) // quantidade_nibs
                 quantidade_folhas = min(quantidade_folhas, folhas_possiveis)
                 
-                folhas = []
-                total_registros_atualizados = 0
+                # Linhas já agrupadas por FOLHA (e na ordenação acima dentro de cada folha) pelo SQL
+                resultado_df = df
                 
-                for i in range(quantidade_folhas):
-                    nibs_na_folha = nibs_unicos[i * quantidade_nibs: (i + 1) * quantidade_nibs].tolist()
-                    folha_df = df[df['nib'].isin(nibs_na_folha)].copy()
-                    folha_df['FOLHA'] = i + 1
-                    folhas.append(folha_df)
-                    
-                    # 4. Atualização de Estado
-                    update_where_conditions = ["LOWER(TRIM(estado)) != 'prog'"]
-                    update_params = {'nibs': nibs_na_folha}
-                    
-                    if criterio_tipo and criterio_valor:
-                        coluna_criterio = self.MAPEAMENTO_CRITERIOS.get(criterio_tipo)
-                        if coluna_criterio:
-                            update_where_conditions.append(f"UPPER(TRIM({coluna_criterio})) = :criterio_valor")
-                            update_params['criterio_valor'] = criterio_valor.strip().upper()
-
-                    if tipo_folha == "PT" or tipo_folha == "LOCALIDADE":
-                        coluna_filtro = 'pt' if tipo_folha == "PT" else 'localidade'
-                        update_where_conditions.append(f"UPPER(TRIM({coluna_filtro})) = :valor_update")
-                        update_params['valor_update'] = valor_selecionado.strip().upper()
-                    
-                    update_query = text(f"""
-                        UPDATE bd SET estado = 'prog' 
-                        WHERE nib = ANY(:nibs) AND {' AND '.join(update_where_conditions)}
-                    """)
-                    
-                    result = conn.execute(update_query, update_params)
-                    total_registros_atualizados += result.rowcount
+                # 5. Atualização de Estado: um único UPDATE para os NIBs de todas as folhas
+                update_where_conditions = ["bd.estado_norm != 'prog'"]
+                update_params = {'nibs': nibs_unicos}
+                
+                if criterio_tipo and criterio_valor:
+                    coluna_criterio = self.MAPEAMENTO_CRITERIOS.get(criterio_tipo)
+                    if coluna_criterio:
+                        update_where_conditions.append(f"{self._expressao_normalizada(coluna_criterio)} = :criterio_valor")
+                        update_params['criterio_valor'] = criterio_valor.strip().upper()
+
+                if tipo_folha == "PT" or tipo_folha == "LOCALIDADE":
+                    coluna_filtro = 'pt' if tipo_folha == "PT" else 'localidade'
+                    update_where_conditions.append(f"bd.{coluna_filtro}_norm = :valor_update")
+                    update_params['valor_update'] = valor_selecionado.strip().upper()
+                
+                update_query = text(f"""
+                    WITH picks(nib) AS (SELECT unnest(CAST(:nibs AS text[])))
+                    UPDATE bd SET estado = 'prog'
+                    FROM picks
+                    WHERE COALESCE(TRIM(bd.nib), '') = picks.nib AND {' AND '.join(update_where_conditions)}
+                """)
+                
+                result = conn.execute(update_query, update_params)
+                total_registros_atualizados = result.rowcount
             
                 conn.commit()
+                # Caches descartados já (relatórios leem a bd, que mudou); as views são recalculadas
+                # em segundo plano, como no reset, e o refresh descarta os caches de novo ao terminar
+                self._limpar_cache_dashboard()
+                _REFRESH_POOL.submit(self.atualizar_views_dashboard)
                 st.success(f"✅ Estado atualizado para 'prog' em {total_registros_atualizados} registros.")
-                logger.info(f"Folhas geradas: {quantidade_folhas}, registros atualizados: {total_registros_atualizados}")
+                logger.info("Folhas geradas: %s, registros atualizados: %s", quantidade_folhas, total_registros_atualizados)
                 
-                if folhas:
-                    resultado_df = pd.concat(folhas, ignore_index=True)
-                    return resultado_df, cils_restantes_nao_encontrados
-                else:
-                    return None, cils_restantes_nao_encontrados
+                return resultado_df, cils_restantes_nao_encontrados
             
         except Exception as e:
             error_msg = f"❌ Erro ao gerar folhas no Postgres: {str(e)}"
@@ -602,6 +1541,9 @@ class PostgresDatabaseManager:
             logger.error(error_msg)
             return None, []
 
+    # Linhas por UPDATE no reset: cada lote é uma transação curta (locks liberados entre lotes)
+    RESET_LOTE = 10000
+
     def resetar_estado(self, tipo, valor):
         """Reseta o estado 'prog' para o tipo e valor selecionados."""
         try:
@@ -609,21 +1551,38 @@ class PostgresDatabaseManager:
                 valor_sql = valor.strip().upper() if valor else ""
                 
                 if tipo == 'PT':
-                    query = text("UPDATE bd SET estado = '' WHERE LOWER(TRIM(estado)) = 'prog' AND UPPER(TRIM(pt)) = :valor")
+                    where = "estado_norm = 'prog' AND pt_norm = :valor"
                     params = {"valor": valor_sql}
                 elif tipo == 'LOCALIDADE':
-                    query = text("UPDATE bd SET estado = '' WHERE LOWER(TRIM(estado)) = 'prog' AND UPPER(TRIM(localidade)) = :valor")
+                    where = "estado_norm = 'prog' AND localidade_norm = :valor"
                     params = {"valor": valor_sql}
                 elif tipo == 'AVULSO':
-                    query = text("UPDATE bd SET estado = '' WHERE LOWER(TRIM(estado)) = 'prog'")
+                    where = "estado_norm = 'prog'"
                     params = {}
                 else:
                     return False, "Tipo de reset inválido."
-                    
-                result = conn.execute(query, params)
-                conn.commit()
-                registros_afetados = result.rowcount
-                logger.info(f"Reset de estado: {tipo} - {valor}, {registros_afetados} registros afetados")
+                
+                # Lotes localizados pelo índice parcial idx_bd_prog e atualizados por ctid (TID scan);
+                # linhas resetadas saem do predicado, então o laço termina quando um lote vem incompleto
+                query = text(f"""
+                    UPDATE bd SET estado = ''
+                    WHERE ctid = ANY(ARRAY(SELECT ctid FROM bd WHERE {where} LIMIT :lote))
+                """)
+                params['lote'] = self.RESET_LOTE
+                registros_afetados = 0
+                while True:
+                    self._sem_limite_de_tempo(conn)
+                    atualizados = conn.execute(query, params).rowcount
+                    conn.commit()
+                    registros_afetados += atualizados
+                    if atualizados < self.RESET_LOTE:
+                        break
+                
+                # Caches descartados logo após o último lote (relatórios leem a bd); as views são
+                # recalculadas em segundo plano e o refresh descarta os caches de novo ao terminar
+                self._limpar_cache_dashboard()
+                _REFRESH_POOL.submit(self.atualizar_views_dashboard)
+                logger.info("Reset de estado: %s - %s, %s registros afetados", tipo, valor, registros_afetados)
                 return True, registros_afetados
                 
         except Exception as e:
@@ -633,169 +1592,153 @@ class PostgresDatabaseManager:
             return False, 0
 
     # --- NOVOS MÉTODOS PARA RELATÓRIOS E DASHBOARDS ---
+    # Persistidos em disco: sobrevivem ao reinício do worker. Com persist o Streamlit ignora o ttl;
+    # a invalidação é explícita (_limpar_cache_dashboard após carga/mudança de estado, botão de atualizar).
     
-    @st.cache_data(ttl=1800, show_spinner=False)
+    @st.cache_data(max_entries=128, persist='disk', show_spinner=False)
     def obter_estatisticas_gerais(_self):
         """Obtém estatísticas gerais do sistema para dashboard."""
         try:
-            with _self.engine.connect() as conn:
-                # Estatísticas principais
-                stats_query = text("""
-                    SELECT 
-                        COUNT(*) as total_registros,
-                        COUNT(DISTINCT cil) as cils_unicos,
-                        COUNT(DISTINCT pt) as pts_unicos,
-                        COUNT(DISTINCT localidade) as localidades_unicas,
-                        COUNT(DISTINCT nib) as nibs_unicos,
-                        SUM(CASE WHEN LOWER(TRIM(estado)) = 'prog' THEN 1 ELSE 0 END) as registros_em_progresso,
-                        SUM(qtd) as total_qtd,
-                        SUM(valor) as total_valor,
-                        AVG(qtd) as media_qtd,
-                        AVG(valor) as media_valor
-                    FROM bd
-                """)
+            with _self._conectar_leitura() as conn:
+                # Estatísticas principais (pré-calculadas na view): uma linha lida direto como dict, sem DataFrame
+                stats_query = text(f"SELECT * FROM {_self._nome_view('stats')} WHERE chave = 1")
                 
-                stats_df = pd.read_sql_query(stats_query, conn)
+                linha = conn.execute(stats_query).mappings().first()
                 
                 return {
-                    'estatisticas_gerais': stats_df.iloc[0].to_dict() if not stats_df.empty else {}
+                    'estatisticas_gerais': {k: v for k, v in linha.items() if k != 'chave'} if linha else {}
                 }
                 
         except Exception as e:
-            logger.error(f"Erro ao obter estatísticas: {e}")
+            logger.error("Erro ao obter estatísticas: %s", e)
             return {}
     
-    @st.cache_data(ttl=1800, show_spinner=False)
+    @st.cache_data(max_entries=128, persist='disk', show_spinner=False)
     def obter_metricas_operacionais(_self):
         """Obtém métricas operacionais para relatórios."""
         try:
-            with _self.engine.connect() as conn:
-                # Eficiência por PT
-                eficiencia_pt_query = text("""
-                    SELECT 
-                        UPPER(TRIM(pt)) as pt,
-                        COUNT(*) as total_registros,
-                        SUM(CASE WHEN LOWER(TRIM(estado)) = 'prog' THEN 1 ELSE 0 END) as em_progresso,
-                        ROUND(SUM(CASE WHEN LOWER(TRIM(estado)) = 'prog' THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) as percentual_progresso,
-                        SUM(valor) as valor_total,
-                        AVG(valor) as valor_medio
-                    FROM bd
-                    WHERE pt IS NOT NULL AND TRIM(pt) != ''
-                    GROUP BY UPPER(TRIM(pt))
-                    HAVING COUNT(*) > 10
-                    ORDER BY total_registros DESC
-                    LIMIT 15
-                """)
-                
-                eficiencia_pt_df = pd.read_sql_query(eficiencia_pt_query, conn)
-                
-                # Top localidades por valor
-                top_localidades_query = text("""
-                    SELECT 
-                        UPPER(TRIM(localidade)) as localidade,
-                        COUNT(*) as total_registros,
-                        SUM(valor) as valor_total,
-                        AVG(valor) as valor_medio
-                    FROM bd
-                    WHERE localidade IS NOT NULL AND TRIM(localidade) != ''
-                    GROUP BY UPPER(TRIM(localidade))
-                    ORDER BY valor_total DESC
-                    LIMIT 15
+            with _self._conectar_leitura() as conn:
+                # As três métricas numa única ida ao banco: cada subconsulta vira um array JSON
+                # de objetos (uma coluna por métrica, numa linha só)
+                metricas_query = text(f"""
+                    SELECT
+                        (SELECT json_agg(t) FROM (
+                            SELECT pt, total_registros, em_progresso, percentual_progresso, valor_total, valor_medio
+                            FROM {_self._nome_view('top_pt')}
+                            ORDER BY total_registros DESC
+                        ) t) as eficiencia_pt,
+                        (SELECT json_agg(t) FROM (
+                            SELECT localidade, total_registros, valor_total, valor_medio
+                            FROM {_self._nome_view('top_localidades')}
+                            ORDER BY valor_total DESC NULLS LAST
+                            LIMIT 8
+                        ) t) as top_localidades,
+                        (SELECT json_agg(t) FROM (
+                            SELECT lat, long, densidade, valor_total
+                            FROM {_self._nome_view('geoloc')}
+                            WHERE densidade > 1
+                        ) t) as geolocalizacao
                 """)
                 
-                top_localidades_df = pd.read_sql_query(top_localidades_query, conn)
-                
-                # Distribuição geográfica (com coordenadas)
-                geolocalizacao_query = text("""
-                    SELECT 
-                        lat,
-                        long,
-                        COUNT(*) as densidade,
-                        SUM(valor) as valor_total
-                    FROM bd
-                    WHERE lat IS NOT NULL AND long IS NOT NULL 
-                    AND lat != 0 AND long != 0
-                    GROUP BY lat, long
-                    HAVING COUNT(*) > 1
-                """)
-                
-                geolocalizacao_df = pd.read_sql_query(geolocalizacao_query, conn)
+                row = conn.execute(metricas_query).one()
                 
+                # json_agg de zero linhas é NULL
                 return {
-                    'eficiencia_pt': eficiencia_pt_df.to_dict('records'),
-                    'top_localidades': top_localidades_df.to_dict('records'),
-                    'geolocalizacao': geolocalizacao_df.to_dict('records')
+                    'eficiencia_pt': row.eficiencia_pt or [],
+                    'top_localidades': row.top_localidades or [],
+                    'geolocalizacao': row.geolocalizacao or []
                 }
                 
         except Exception as e:
-            logger.error(f"Erro ao obter métricas operacionais: {e}")
+            logger.error("Erro ao obter métricas operacionais: %s", e)
             return {}
 
-    @st.cache_data(ttl=1800, show_spinner=False)
-    def obter_dados_para_dashboard(_self, criterio, valor_filtro=None):
-        """Obtém dados específicos para o dashboard baseado no critério selecionado."""
+    @st.cache_data(max_entries=1, persist='disk', show_spinner=False)
+    def _rollup_dashboard(_self):
+        """Todas as distribuições do dashboard (os 6 critérios) numa só consulta à view criterio_rollup.
+        
+        A primeira chamada de qualquer critério busca a view inteira (pequena, já agrupada);
+        trocar de critério depois não faz checkout de conexão nem ida ao banco.
+        """
+        with _self._conectar_leitura() as conn:
+            return pd.read_sql_query(
+                text(f"SELECT dim, val, quantidade, total_valor, valor_medio FROM {_self._nome_view('criterio_rollup')}"),
+                conn,
+                dtype_backend='pyarrow'
+            )
+
+    @st.cache_data(max_entries=128, persist='disk', show_spinner=False)
+    def obter_dados_para_dashboard(_self, criterio, valor_filtro=None, top_n=None, order_by='quantidade'):
+        """Obtém dados específicos para o dashboard baseado no critério selecionado.
+        
+        Com top_n, devolve apenas as top_n linhas por order_by ('quantidade' ou
+        'total_valor'); os totais continuam calculados sobre todas as linhas.
+        """
         try:
-            with _self.engine.connect() as conn:
-                # Mapear o nome do critério para a coluna no banco
-                mapeamento_colunas = {
-                    'Criterio': 'criterio',
-                    'Anomalia': 'anomalia',
-                    'EST_CTR': 'est_contr',
-                    'sit_div': 'sit_div', 
-                    'est_inspec': 'est_inspec',
-                    'desv': 'desv'
-                }
-                
-                # Validação estrita de segurança
-                if criterio not in mapeamento_colunas:
-                    logger.error(f"Tentativa de injeção ou critério inválido: {criterio}")
-                    return {}
-                    
-                coluna_sql = mapeamento_colunas[criterio]
-                
-                # Query base
-                query = f"""
-                    SELECT 
-                        UPPER(TRIM({coluna_sql})) as {criterio.lower()},
-                        COUNT(*) as quantidade,
-                        SUM(valor) as total_valor,
-                        AVG(valor) as valor_medio
-                    FROM bd 
-                    WHERE {coluna_sql} IS NOT NULL 
-                    AND TRIM({coluna_sql}) != ''
-                """
-                
-                params = {}
-                
-                # Aplicar filtro se especificado
-                if valor_filtro and valor_filtro != "Todos":
-                    query += f" AND UPPER(TRIM({coluna_sql})) = :valor_filtro"
-                    params['valor_filtro'] = valor_filtro.upper().strip()
-                
-                query += f" GROUP BY UPPER(TRIM({coluna_sql}))"
-                
-                # Ordenar por quantidade (mais relevante para dashboard)
-                query += " ORDER BY quantidade DESC, total_valor DESC"
-                
-                df_resultado = pd.read_sql_query(text(query), conn, params=params)
-                
-                return {
-                    'distribuicao_criterio': df_resultado.to_dict('records')
-                }
+            # Validação estrita do critério (só valores conhecidos viram nome de coluna)
+            if criterio not in _self.MAPEAMENTO_DASHBOARD:
+                logger.error("Tentativa de injeção ou critério inválido: %s", criterio)
+                return {}
+            
+            # Linhas do critério no rollup compartilhado (em cache: sem conexão por critério)
+            rollup = _self._rollup_dashboard()
+            df_resultado = rollup[rollup['dim'] == criterio].drop(columns=['dim'])
+            
+            # Aplicar filtro se especificado
+            if valor_filtro and valor_filtro != "Todos":
+                df_resultado = df_resultado[df_resultado['val'] == valor_filtro.upper().strip()]
+            
+            # Totais sobre todas as linhas do critério (antes do top_n)
+            totais = {
+                'registros': int(df_resultado['quantidade'].sum()),
+                'valor': float(df_resultado['total_valor'].sum())
+            }
+            
+            # Ordenar por quantidade (mais relevante para dashboard) ou por valor
+            if order_by == 'total_valor':
+                ordem = ['total_valor', 'quantidade']
+            else:
+                ordem = ['quantidade', 'total_valor']
+            df_resultado = df_resultado.sort_values(ordem, ascending=False, na_position='last')
+            
+            if top_n:
+                df_resultado = df_resultado.head(int(top_n))
+            
+            return {
+                'distribuicao_criterio': df_resultado.rename(columns={'val': criterio.lower()}).reset_index(drop=True),
+                'totais': totais
+            }
                 
         except Exception as e:
-            logger.error(f"Erro ao obter dados para dashboard ({criterio}): {e}")
+            logger.error("Erro ao obter dados para dashboard (%s): %s", criterio, e)
             return {}
     
-    def gerar_relatorio_detalhado(_self, filtros=None):
-        """Gera relatório detalhado com base em filtros."""
+    # Colunas padrão do relatório detalhado; qualquer subconjunto de COLUNAS_BD pode ser pedido
+    COLUNAS_RELATORIO = (
+        'cil', 'pt', 'localidade', 'criterio', 'anomalia',
+        'situacao', 'qtd', 'valor', 'estado', 'nib',
+        'desc_tp_cli', 'est_contr', 'sit_div', 'est_inspec'
+    )
+
+    @st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+    def gerar_relatorio_detalhado(_self, filtros=None, colunas=COLUNAS_RELATORIO):
+        """Gera relatório detalhado com base em filtros (em cache por combinação de filtros e colunas).
+        
+        colunas limita o SELECT (ex.: ('cil', 'pt', 'valor')): colunas largas como desc_tp_cli
+        só são lidas do heap quando pedidas.
+        """
         try:
-            with _self.engine.connect() as conn:
-                base_query = """
-                    SELECT 
-                        cil, pt, localidade, criterio, anomalia, 
-                        situacao, qtd, valor, estado, nib,
-                        desc_tp_cli, est_contr, sit_div, est_inspec
+            # Validação estrita: só nomes de colunas da BD entram no SQL
+            invalidas = set(colunas) - set(_self.COLUNAS_BD)
+            if not colunas or invalidas:
+                logger.error("Colunas inválidas para o relatório: %s", sorted(invalidas) or colunas)
+                return pd.DataFrame()
+            
+            # Conexão transacional (não _conectar_leitura): o cursor nomeado de _ler_arrow_em_blocos
+            # vive na transação, que o fechamento da conexão desfaz (só leitura)
+            with _self._get_conn() as conn:
+                base_query = f"""
+                    SELECT {", ".join(colunas)}
                     FROM bd 
                     WHERE 1=1
                 """
@@ -805,26 +1748,37 @@ class PostgresDatabaseManager:
                 # Aplicar filtros
                 if filtros:
                     if filtros.get('criterio'):
-                        base_query += " AND UPPER(TRIM(criterio)) = :criterio"
+                        base_query += " AND criterio_norm = :criterio"
                         params['criterio'] = filtros['criterio'].upper().strip()
                     
                     if filtros.get('pt'):
-                        base_query += " AND UPPER(TRIM(pt)) = :pt"
+                        base_query += " AND pt_norm = :pt"
                         params['pt'] = filtros['pt'].upper().strip()
                     
                     if filtros.get('localidade'):
-                        base_query += " AND UPPER(TRIM(localidade)) = :localidade"
+                        base_query += " AND localidade_norm = :localidade"
                         params['localidade'] = filtros['localidade'].upper().strip()
                     
                     if filtros.get('estado'):
-                        base_query += " AND LOWER(TRIM(estado)) = :estado"
+                        base_query += " AND estado_norm = :estado"
                         params['estado'] = filtros['estado'].lower().strip()
                 
                 base_query += " ORDER BY pt, localidade, criterio"
                 
-                df = pd.read_sql_query(text(base_query), conn, params=params)
+                caminho_cache = _self._caminho_cache_relatorio(base_query, params)
+                df = _self._ler_cache_relatorio(caminho_cache)
+                if df is not None:
+                    return df
+                
+                # Dtypes Arrow: o st.dataframe serializa o relatório sem conversão de colunas object.
+                # Com o ConnectorX o resultado já chega em Arrow; sem ele, blocos de 50 mil linhas viram Arrow um a um.
+                if CONNECTORX_AVAILABLE:
+                    df = _self._ler_arrow(conn, base_query, params)
+                else:
+                    df = _self._ler_arrow_em_blocos(conn, base_query, params)
+                _self._gravar_cache_relatorio(caminho_cache, df)
                 return df
                 
         except Exception as e:
-            logger.error(f"Erro ao gerar relatório detalhado: {e}")
+            logger.error("Erro ao gerar relatório detalhado: %s", e)
             return pd.DataFrame()
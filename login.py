@@ -1,11 +1,34 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
 import logging
+import os
+from sessao import salvar_sessao_no_cookie
 
 logger = logging.getLogger(__name__)
 
-def login_page(db_manager):
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+
+@st.cache_resource(show_spinner=False)
+def carregar_assets_login():
+    """Lê do disco, uma única vez por processo, o logo e o CSS opcionais da página de login."""
+    assets = {}
+    logo_path = os.path.join(ASSETS_DIR, 'logo.png')
+    css_path = os.path.join(ASSETS_DIR, 'login.css')
+    if os.path.exists(logo_path):
+        with open(logo_path, 'rb') as f:
+            assets['logo'] = f.read()
+    if os.path.exists(css_path):
+        with open(css_path, encoding='utf-8') as f:
+            assets['css'] = f.read()
+    return assets
+
+def login_page(db_manager, assets=None):
     """Página de login."""
+    assets = assets or {}
+    if assets.get('css'):
+        st.markdown(f"<style>{assets['css']}</style>", unsafe_allow_html=True)
+    if assets.get('logo'):
+        st.image(assets['logo'], width=160)
     st.title("Sistema de Gestão de Dados - Login")
     
     with st.form("login_form"):
@@ -23,9 +46,10 @@ def login_page(db_manager):
                 if user_info:
                     st.session_state['authenticated'] = True
                     st.session_state['user'] = user_info
+                    salvar_sessao_no_cookie(user_info)
                     st.success(f"Bem-vindo(a), {user_info['nome']}!")
-                    logger.info(f"Login bem-sucedido para: {username}")
+                    logger.info("Login bem-sucedido para: %s", username)
                     st.rerun()
                 else:
                     st.error("Nome de usuário ou senha inválidos.")
-                    logger.warning(f"Tentativa de login inválida para: {username}")
+                    logger.warning("Tentativa de login inválida para: %s", username)
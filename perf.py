@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import streamlit as st
+import pandas as pd
+import logging
+import functools
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_STATS_KEY = '_cache_stats'
+
+def _registrar(nome, hit, ms):
+    """Acumula hits/misses e o tempo da última chamada da função em st.session_state."""
+    try:
+        stats = st.session_state.setdefault(CACHE_STATS_KEY, {})
+        entrada = stats.setdefault(nome, {'hits': 0, 'misses': 0, 'last_ms': 0.0})
+        entrada['hits' if hit else 'misses'] += 1
+        entrada['last_ms'] = round(ms, 1)
+    except Exception as e:
+        # Fora de uma sessão Streamlit (ex.: thread em segundo plano) não há onde registrar
+        logger.debug("Estatística de cache não registrada para %s: %s", nome, e)
+
+def traced_cache_data(**cache_kwargs):
+    """Equivalente a @st.cache_data(**cache_kwargs), registrando hits, misses e tempo por função."""
+    def decorator(func):
+        nome = func.__qualname__
+        executou = threading.local()
+
+        @functools.wraps(func)
+        def executar(*args, **kwargs):
+            # Só roda quando o st.cache_data não tem o resultado (miss)
+            executou.flag = True
+            return func(*args, **kwargs)
+
+        cached = st.cache_data(**cache_kwargs)(executar)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            executou.flag = False
+            inicio = time.perf_counter()
+            resultado = cached(*args, **kwargs)
+            _registrar(nome, hit=not executou.flag, ms=(time.perf_counter() - inicio) * 1000)
+            return resultado
+
+        wrapper.clear = cached.clear
+        return wrapper
+    return decorator
+
+def mostrar_estatisticas_cache():
+    """Expander no sidebar com hits/misses e tempo da última chamada de cada função cacheada."""
+    stats = st.session_state.get(CACHE_STATS_KEY)
+    if not stats:
+        return
+    with st.sidebar.expander("Cache stats"):
+        df_stats = pd.DataFrame.from_dict(stats, orient='index')
+        df_stats.index.name = 'funcao'
+        st.dataframe(df_stats, use_container_width=True)
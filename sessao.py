@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import streamlit as st
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tentar importar dependências do cookie de sessão com fallback
+try:
+    import extra_streamlit_components as stx
+    from itsdangerous import URLSafeTimedSerializer, BadSignature
+    COOKIES_AVAILABLE = True
+except ImportError:
+    COOKIES_AVAILABLE = False
+
+AUTH_COOKIE = 'auth'
+AUTH_COOKIE_MAX_AGE = 3600  # segundos
+COOKIES_KEY = '_cookies'
+
+def _serializer():
+    """Assina/valida o token do cookie com o segredo de st.secrets['auth']['cookie_secret']."""
+    try:
+        secret = st.secrets["auth"]["cookie_secret"]
+    except Exception:
+        return None
+    return URLSafeTimedSerializer(secret, salt='vf-auth-cookie')
+
+def iniciar_cookies():
+    """Instancia o CookieManager do rerun (o componente só pode ser criado uma vez por execução)."""
+    cookies = None
+    if COOKIES_AVAILABLE and _serializer() is not None:
+        cookies = stx.CookieManager(key='cookie_manager')
+    st.session_state[COOKIES_KEY] = cookies
+    return cookies
+
+def restaurar_sessao_do_cookie():
+    """Restaura o usuário autenticado a partir do cookie assinado, sem consultar o banco."""
+    cookies = st.session_state.get(COOKIES_KEY)
+    serializer = _serializer()
+    if not cookies or not serializer or st.session_state.get('_logout'):
+        return False
+
+    token = cookies.get(AUTH_COOKIE)
+    if not token:
+        return False
+
+    try:
+        payload = serializer.loads(token, max_age=AUTH_COOKIE_MAX_AGE)
+    except BadSignature as e:
+        # Inclui SignatureExpired (token com mais de AUTH_COOKIE_MAX_AGE)
+        logger.info("Cookie de sessão inválido ou expirado: %s", e)
+        return False
+
+    st.session_state['authenticated'] = True
+    st.session_state['user'] = payload['user']
+    logger.info("Sessão restaurada via cookie para: %s", payload['user']['username'])
+    return True
+
+def salvar_sessao_no_cookie(user_info):
+    """Grava o usuário autenticado num cookie assinado com validade de AUTH_COOKIE_MAX_AGE."""
+    cookies = st.session_state.get(COOKIES_KEY)
+    serializer = _serializer()
+    st.session_state.pop('_logout', None)
+    if not cookies or not serializer:
+        return
+
+    cookies.set(
+        AUTH_COOKIE,
+        serializer.dumps({'user': user_info}),
+        expires_at=datetime.datetime.now() + datetime.timedelta(seconds=AUTH_COOKIE_MAX_AGE),
+        key='set_auth_cookie'
+    )
+
+def limpar_sessao_do_cookie():
+    """Remove o cookie de sessão (logout)."""
+    # O delete só chega ao navegador depois do rerun; evita restaurar a sessão nesse meio tempo
+    st.session_state['_logout'] = True
+    cookies = st.session_state.get(COOKIES_KEY)
+    if cookies and cookies.get(AUTH_COOKIE):
+        cookies.delete(AUTH_COOKIE, key='delete_auth_cookie')